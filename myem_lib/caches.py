@@ -0,0 +1,67 @@
+"""Caches."""
+import math
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Any
+
+
+class TtlLruCache:
+    """Ttl Lru Cache.
+
+    LRU of at most maxsize values, expiring ttl seconds after they are set (never when ttl is
+    None) or at an earlier expiry given when setting them, times are read from clock. The least
+    recently used value is dropped when the cache is full. It isn't thread safe, callers sharing
+    a cache between threads hold their own lock.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get_entry(key) is not None
+
+    def get_entry(self, key: Hashable) -> tuple[float, Any] | None:
+        """Get the expiry and value of a key, None when it's missing or expired."""
+        if (entry := self.entries.get(key)) is None:
+            return None
+        if entry[0] <= self.clock():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get the value of a key, default when it's missing or expired."""
+        if (entry := self.get_entry(key)) is None:
+            return default
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, expires_at: float | None = None) -> None:
+        """Set the value of a key, until expires_at if it's before its ttl."""
+        ttl_expires_at = math.inf if self.ttl is None else self.clock() + self.ttl
+        if expires_at is None or expires_at > ttl_expires_at:
+            expires_at = ttl_expires_at
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Remove a key."""
+        self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all the keys."""
+        self.entries.clear()
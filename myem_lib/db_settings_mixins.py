@@ -1,10 +1,24 @@
 """DbSettingsMixin."""
+import itertools
+import logging
 import os
+import threading
+import time
+from collections.abc import Iterator
+from contextvars import ContextVar
 from datetime import datetime
 from typing import Any
 
 from sqlalchemy import Column, create_engine, DateTime
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import QueuePool
+from myem_lib.instrumentation import instrument_engine, metrics, request_timings
+
+
+# seconds, a connection attempt to an unreachable database fails instead of hanging the worker
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
 
 
 class Base:
@@ -20,7 +34,7 @@ DeclarativeBase = declarative_base(cls=Base)
 engine_options = {
         "pool_pre_ping": True,
         "connect_args": {
-            "connect_timeout": 31536000,
+            "connect_timeout": DB_CONNECT_TIMEOUT,
             "keepalives": 1,
             "keepalives_idle": 60,
             "keepalives_interval": 10,
@@ -29,29 +43,208 @@ engine_options = {
     }
 
 
+class TimedQueuePool(QueuePool):
+    """Timed Queue Pool.
+
+    Queue pool recording the time spent getting a connection, waiting for a connection to be
+    checked in or connecting included, in the db_pool_wait_seconds histogram of the metrics and in
+    the db phase of the current request.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.checkouts = 0
+
+    def _do_get(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait_time = time.perf_counter() - start
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            self.checkouts += 1
+            metrics.observe(
+                "db_pool_wait_seconds",
+                wait_time,
+                "Time spent getting a connection from the db pool.",
+            )
+            if (timings := request_timings.get()) is not None:
+                timings["db"] = timings.get("db", 0) + wait_time
+
+
+class LazyAttribute:
+    """Lazy Attribute.
+
+    Class attribute computed by a classmethod of the class it's accessed from, so that the class
+    can be imported without the database environment variables and without creating an engine.
+    """
+
+    def __init__(self, getter_name: str) -> None:
+        self.getter_name = getter_name
+
+    def __get__(self, instance: Any, owner: type) -> Any:
+        return getattr(owner, self.getter_name)()
+
+
+# engines and session makers by uri and options, shared by the classes with the same settings
+engines: dict[str, Engine] = {}
+session_makers: dict[str, sessionmaker] = {}
+# keys of the engines and replica engines of the classes
+engine_keys: dict[type, str] = {}
+replica_engine_keys: dict[type, list[str]] = {}
+engines_lock = threading.Lock()
+# time until which the replica of an engine key is not used after a failed connection
+replicas_down_until: dict[str, float] = {}
+replica_counters: dict[type, Iterator[int]] = {}
+
+# set for a request, by a middleware or an async dependency, to send its reads to the primary,
+# e.g. when the client has just written data it reads back.
+read_your_writes: ContextVar[bool] = ContextVar("read_your_writes", default=False)
+
+
+def get_shared_engine_key(db_uri: str, options: dict[str, Any]) -> str:
+    """Get the key of the shared engine of a uri and options, created on first use."""
+    key = repr((db_uri, sorted(options.items())))
+    with engines_lock:
+        if key not in engines:
+            engine = create_engine(db_uri, **options)
+            # time spent executing statements, and getting connections from the TimedQueuePool, is
+            # added to the db phase of requests
+            instrument_engine(engine)
+            session_makers[key] = sessionmaker(bind=engine)
+            engines[key] = engine
+    return key
+
+
+def dispose_engines_after_fork() -> None:
+    """Replace the pools of the engines in a forked process, leaving the parent's connections."""
+    for engine in engines.values():
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=dispose_engines_after_fork)
+
+
 class DbSettingsMixin:
-    """Db settings mixin."""
+    """Db settings mixin.
+
+    The engine is created on first use of engine, session_maker or get_db and shared by the
+    classes with the same settings. Settings are read from the environment and can be overridden
+    by subclasses.
+    Read-only work can use get_read_db, which connects to a replica of replica_uris when there
+    is a healthy one and to the primary otherwise or when read_your_writes is set.
+    """
+
+    db_uri: str = LazyAttribute("get_db_uri")  # type: ignore[assignment]
+    pool_size = int(os.getenv("DB_POOL_SIZE", "15"))
+    max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "25"))
+    # seconds
+    pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "600"))
+    # seconds to wait for a connection when the pool and its overflow are checked out
+    pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    connect_timeout = DB_CONNECT_TIMEOUT
+    # milliseconds, statements running longer are cancelled by postgres, 0 disables it
+    statement_timeout = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
 
-    db_uri: str = (
-        f"postgresql+psycopg2://{os.environ['DB_USER']}:{os.environ['DB_PASSWORD']}"
-        f"@{os.environ['DB_HOST']}/{os.environ['DB_NAME']}"
-    )
+    # hosts of the replicas, comma separated, with the user, password and name of the primary
+    replica_uris: list[str] = LazyAttribute("get_replica_uris")  # type: ignore[assignment]
+    # round_robin or least_connections
+    replica_balancing = os.getenv("DB_REPLICA_BALANCING", "round_robin")
+    # seconds a replica is not used after a failed connection
+    replica_retry_interval = float(os.getenv("DB_REPLICA_RETRY_INTERVAL", "30"))
 
-    engine = create_engine(
-        db_uri,
-        connect_args={
-            "connect_timeout": 31536000,
+    engine: Engine = LazyAttribute("get_engine")  # type: ignore[assignment]
+    session_maker: sessionmaker = LazyAttribute("get_session_maker")  # type: ignore[assignment]
+
+    @classmethod
+    def get_db_uri(cls) -> str:
+        """Get the database uri from the environment."""
+        return (
+            f"postgresql+psycopg2://{os.environ['DB_USER']}:{os.environ['DB_PASSWORD']}"
+            f"@{os.environ['DB_HOST']}/{os.environ['DB_NAME']}"
+        )
+
+    @classmethod
+    def get_replica_uris(cls) -> list[str]:
+        """Get the uris of the replicas of DB_REPLICA_HOSTS."""
+        if not (replica_hosts := os.getenv("DB_REPLICA_HOSTS")):
+            return []
+        return [
+            f"postgresql+psycopg2://{os.environ['DB_USER']}:{os.environ['DB_PASSWORD']}"
+            f"@{host.strip()}/{os.environ['DB_NAME']}"
+            for host in replica_hosts.split(",")
+            if host.strip()
+        ]
+
+    @classmethod
+    def get_engine_options(cls) -> dict[str, Any]:
+        """Get the options of the engine."""
+        connect_args: dict[str, Any] = {
+            "connect_timeout": cls.connect_timeout,
             "keepalives": 1,
             "keepalives_idle": 60,
             "keepalives_interval": 10,
             "keepalives_count": 5,
-        },
-        pool_size=15,
-        max_overflow=25,
-        pool_pre_ping=True,
-        pool_recycle=600,
-    )
-    session_maker = sessionmaker(bind=engine)
+        }
+        if cls.statement_timeout:
+            connect_args["options"] = f"-c statement_timeout={cls.statement_timeout}"
+        return {
+            "connect_args": connect_args,
+            "poolclass": TimedQueuePool,
+            "pool_size": cls.pool_size,
+            "max_overflow": cls.max_overflow,
+            "pool_timeout": cls.pool_timeout,
+            "pool_pre_ping": True,
+            "pool_recycle": cls.pool_recycle,
+        }
+
+    @classmethod
+    def get_engine_key(cls) -> str:
+        """Get the key of the engine of the class, its settings are read on first use."""
+        if (key := engine_keys.get(cls)) is None:
+            key = engine_keys[cls] = get_shared_engine_key(cls.db_uri, cls.get_engine_options())
+        return key
+
+    @classmethod
+    def get_replica_engine_keys(cls) -> list[str]:
+        """Get the keys of the replica engines of the class."""
+        if (keys := replica_engine_keys.get(cls)) is None:
+            options = cls.get_engine_options()
+            keys = replica_engine_keys[cls] = [
+                get_shared_engine_key(replica_uri, options) for replica_uri in cls.replica_uris
+            ]
+        return keys
+
+    @classmethod
+    def get_engine(cls) -> Engine:
+        """Get the engine of the settings of the class, created on first use."""
+        return engines[cls.get_engine_key()]
+
+    @classmethod
+    def get_session_maker(cls) -> sessionmaker:
+        """Get the session maker bound to the engine of the class."""
+        return session_makers[cls.get_engine_key()]
+
+    @classmethod
+    def get_pool_stats(cls) -> dict[str, Any]:
+        """Get the connections of the pool of the engine and the time spent getting them."""
+        pool = cls.get_engine().pool
+        if not isinstance(pool, QueuePool):
+            return {}
+        stats: dict[str, Any] = {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        }
+        if isinstance(pool, TimedQueuePool):
+            stats["checkouts"] = pool.checkouts
+            stats["wait_time"] = pool.wait_time
+            stats["max_wait_time"] = pool.max_wait_time
+        return stats
 
     @classmethod
     def get_db(cls) -> Any:
@@ -61,3 +254,42 @@ class DbSettingsMixin:
             yield db
         finally:
             db.close()
+
+    @classmethod
+    def connect_replica(cls) -> Connection | None:
+        """Connect to a healthy replica, None if there is none."""
+        now = time.monotonic()
+        keys = [
+            key for key in cls.get_replica_engine_keys() if replicas_down_until.get(key, 0) <= now
+        ]
+        if not keys:
+            return None
+        if cls.replica_balancing == "least_connections":
+            keys.sort(key=lambda key: getattr(engines[key].pool, "checkedout", int)())
+        else:
+            if (counter := replica_counters.get(cls)) is None:
+                counter = replica_counters.setdefault(cls, itertools.count())
+            start = next(counter) % len(keys)
+            keys = keys[start:] + keys[:start]
+        for key in keys:
+            try:
+                return engines[key].connect()
+            except DBAPIError as e:
+                logging.warning(
+                    f"Replica {engines[key].url!r} is unavailable, not used for "
+                    f"{cls.replica_retry_interval}s: {e}"
+                )
+                replicas_down_until[key] = time.monotonic() + cls.replica_retry_interval
+        return None
+
+    @classmethod
+    def get_read_db(cls) -> Any:
+        """Get database instance for read-only work, on a replica if there is a healthy one."""
+        connection = None if read_your_writes.get() else cls.connect_replica()
+        db = cls.session_maker() if connection is None else cls.session_maker(bind=connection)
+        try:
+            yield db
+        finally:
+            db.close()
+            if connection is not None:
+                connection.close()
@@ -0,0 +1,251 @@
+"""Fast api middlewares."""
+import hashlib
+import zlib
+from typing import Any
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+DEFAULT_COMPRESSED_CONTENT_TYPES = (
+    "application/json",
+    "application/geo+json",
+    "application/xml",
+    "text/csv",
+    "text/html",
+    "text/plain",
+)
+
+# headers a 304 response keeps from the response it replaces
+NOT_MODIFIED_HEADERS = ("cache-control", "content-location", "date", "etag", "expires", "vary")
+
+
+def get_accepted_encodings(accept_encoding: str) -> set[str]:
+    """Get the encodings of an Accept-Encoding header, except the ones with q=0."""
+    encodings = set()
+    for item in accept_encoding.lower().split(","):
+        encoding, _, params = item.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and not params[2:].strip("0."):
+            continue
+        encodings.add(encoding.strip())
+    return encodings
+
+
+class Compressor:
+    """Compressor.
+
+    Compresses a body in one or several chunks with gzip or brotli.
+    """
+
+    def __init__(self, encoding: str, gzip_level: int = 6, brotli_quality: int = 4) -> None:
+        self.encoding = encoding
+        if encoding == "br":
+            # pylint: disable=import-outside-toplevel,import-error
+            # brotli is an optional dependency, gzip is used when it isn't installed
+            import brotli
+
+            self.compressor: Any = brotli.Compressor(quality=brotli_quality)
+        else:
+            self.compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes, final: bool = True) -> bytes:
+        """Compress a chunk, flushed so that it can be sent before the next one."""
+        if self.encoding == "br":
+            return self.compressor.process(data) + (
+                self.compressor.finish() if final else self.compressor.flush()
+            )
+        return self.compressor.compress(data) + self.compressor.flush(
+            zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+        )
+
+
+class CompressionMiddleware:
+    """Compression Middleware.
+
+    Compresses the responses of at least minimum_size bytes whose content type is one of
+    content_types, with brotli when the client accepts it and brotli is installed, else gzip.
+    Streaming responses are compressed chunk by chunk.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        content_types: tuple[str, ...] = DEFAULT_COMPRESSED_CONTENT_TYPES,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.content_types = content_types
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = ["gzip"]
+        try:
+            # pylint: disable=import-outside-toplevel,unused-import
+            import brotli  # noqa: F401
+
+            self.encodings.insert(0, "br")
+        except ImportError:
+            pass
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Compress the response of a request."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accepted_encodings = get_accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        encoding = next((e for e in self.encodings if e in accepted_encodings), None)
+        await self.app(scope, receive, CompressionResponder(self, encoding, send).send)
+
+    def is_compressible(self, headers: Headers) -> bool:
+        """Whether a response of these headers can be compressed."""
+        content_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+        return "content-encoding" not in headers and content_type in self.content_types
+
+
+class CompressionResponder:
+    """Compression Responder.
+
+    Compresses the response of a request for the CompressionMiddleware.
+    """
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str | None, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send_message = send
+        self.start_message: Message | None = None
+        self.compressor: Compressor | None = None
+
+    async def send(self, message: Message) -> None:
+        """Send a message of the response, compressed if needed."""
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send_message(message)
+            return
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if (start_message := self.start_message) is not None:
+            self.start_message = None
+            headers = MutableHeaders(raw=start_message["headers"])
+            if start_message["status"] == 304:
+                headers.add_vary_header("Accept-Encoding")
+            elif start_message["status"] not in (204, 206) and self.middleware.is_compressible(
+                headers
+            ):
+                headers.add_vary_header("Accept-Encoding")
+                if self.encoding and (more_body or len(body) >= self.middleware.minimum_size):
+                    self.compressor = Compressor(
+                        self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality
+                    )
+                    headers["Content-Encoding"] = self.encoding
+                    # the compressed body differs from the one a strong ETag identifies
+                    if (etag := headers.get("etag")) and not etag.startswith("W/"):
+                        headers["ETag"] = f"W/{etag}"
+                    if more_body:
+                        del headers["Content-Length"]
+            if self.compressor:
+                body = self.compressor.compress(body, final=not more_body)
+                if not more_body:
+                    headers["Content-Length"] = str(len(body))
+            await self.send_message(start_message)
+        elif self.compressor:
+            body = self.compressor.compress(body, final=not more_body)
+        await self.send_message({**message, "body": body})
+
+
+def is_etag_matching(etag: str, if_none_match: str) -> bool:
+    """Weak comparison of an ETag with the tags of an If-None-Match header."""
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class ETagMiddleware:
+    """ETag Middleware.
+
+    Adds a weak ETag, a hash of the body, to the successful responses of GET requests that have
+    no ETag, a handler can set its own ETag header from a version of the data instead. Requests
+    whose If-None-Match matches the ETag of the response get an empty 304 response. Streaming
+    responses are only handled when their handler sets an ETag.
+    """
+
+    def __init__(self, app: ASGIApp, maximum_size: int = 64 * 1024 * 1024) -> None:
+        self.app = app
+        # bodies bigger than that are not hashed
+        self.maximum_size = maximum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Handle the ETag of the response of a request."""
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        responder = ETagResponder(self, scope, send)
+        await self.app(scope, receive, responder.send)
+
+
+class ETagResponder:
+    """ETag Responder.
+
+    Handles the ETag of the response of a request for the ETagMiddleware.
+    """
+
+    def __init__(self, middleware: ETagMiddleware, scope: Scope, send: Send):
+        self.middleware = middleware
+        self.method = scope["method"]
+        self.if_none_match = Headers(scope=scope).get("if-none-match")
+        self.send_message = send
+        self.start_message: Message | None = None
+        self.not_modified = False
+
+    async def send(self, message: Message) -> None:
+        """Send a message of the response, or a 304 response if not modified."""
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send_message(message)
+            return
+        if self.not_modified:
+            return
+        if (start_message := self.start_message) is None:
+            await self.send_message(message)
+            return
+        self.start_message = None
+        body = message.get("body", b"")
+        headers = MutableHeaders(raw=start_message["headers"])
+        etag = headers.get("etag")
+        if (
+            etag is None
+            and start_message["status"] == 200
+            and self.method == "GET"
+            and not message.get("more_body", False)
+            and len(body) <= self.middleware.maximum_size
+        ):
+            etag = headers["ETag"] = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        if (
+            etag
+            and self.if_none_match
+            and start_message["status"] == 200
+            and is_etag_matching(etag, self.if_none_match)
+        ):
+            self.not_modified = True
+            await self.send_message(
+                {
+                    "type": "http.response.start",
+                    "status": 304,
+                    "headers": [
+                        (key, value)
+                        for key, value in headers.raw
+                        if key.decode("latin-1") in NOT_MODIFIED_HEADERS
+                    ],
+                }
+            )
+            await self.send_message({"type": "http.response.body", "body": b""})
+            return
+        await self.send_message(start_message)
+        await self.send_message(message)
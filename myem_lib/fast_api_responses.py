@@ -0,0 +1,106 @@
+"""Fast api responses."""
+from collections.abc import AsyncIterable, AsyncIterator, Iterable, Iterator
+from decimal import Decimal
+from typing import Any
+
+from fastapi.responses import JSONResponse, StreamingResponse
+from myem_lib.instrumentation import phase_timer
+
+
+def orjson_default(obj: Any) -> Any:
+    """Serialize the types not handled natively by orjson, like jsonable_encoder."""
+    if isinstance(obj, Decimal):
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)  # type: ignore[operator]
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode()
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    if hasattr(obj, "dict"):
+        return obj.dict()
+    # numpy scalars and arrays of objects not serialized by OPT_SERIALIZE_NUMPY
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def orjson_dumps(content: Any) -> bytes:
+    """Serialize content to JSON with orjson, datetimes, UUIDs and numpy arrays are native."""
+    # pylint: disable=import-outside-toplevel
+    # orjson is an optional dependency, only needed by apps using these responses
+    import orjson
+
+    return orjson.dumps(
+        content,
+        default=orjson_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+    )
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response serialized with orjson.
+
+    The content is serialized as is, endpoints returning this response directly skip the
+    jsonable_encoder pass.
+    """
+
+    def render(self, content: Any) -> bytes:
+        """Serialize the content with orjson."""
+        with phase_timer("encoding"):
+            return orjson_dumps(content)
+
+
+class StreamingJSONResponse(StreamingResponse):
+    """Streaming JSON response.
+
+    Streams rows produced by a sync or async iterable as a JSON array, rows are serialized one by
+    one with orjson and sent in chunks of about chunk_size bytes, the full list is never built.
+
+    Example:
+        @app.get("/points")
+        def get_points(db: Session = Depends(get_db)) -> StreamingJSONResponse:
+            rows = db.execute(select(Point)).yield_per(1000)
+            return StreamingJSONResponse(row._asdict() for row in rows)
+    """
+
+    def __init__(
+        self,
+        rows: Iterable[Any] | AsyncIterable[Any],
+        status_code: int = 200,
+        headers: dict[str, str] | None = None,
+        chunk_size: int = 65536,
+    ) -> None:
+        self.chunk_size = chunk_size
+        content: Iterator[bytes] | AsyncIterator[bytes]
+        if isinstance(rows, AsyncIterable):
+            content = self.aiter_json(rows)
+        else:
+            content = self.iter_json(rows)
+        super().__init__(content, status_code, headers, media_type="application/json")
+
+    def iter_json(self, rows: Iterable[Any]) -> Iterator[bytes]:
+        """Serialize rows as chunks of a JSON array."""
+        chunk = bytearray(b"[")
+        separator = b""
+        for row in rows:
+            chunk += separator
+            chunk += orjson_dumps(row)
+            separator = b","
+            if len(chunk) >= self.chunk_size:
+                yield bytes(chunk)
+                chunk = bytearray()
+        yield bytes(chunk + b"]")
+
+    async def aiter_json(self, rows: AsyncIterable[Any]) -> AsyncIterator[bytes]:
+        """Serialize the rows of an async iterable as chunks of a JSON array."""
+        chunk = bytearray(b"[")
+        separator = b""
+        async for row in rows:
+            chunk += separator
+            chunk += orjson_dumps(row)
+            separator = b","
+            if len(chunk) >= self.chunk_size:
+                yield bytes(chunk)
+                chunk = bytearray()
+        yield bytes(chunk + b"]")
@@ -1,7 +1,15 @@
 """FastApiSettingsMixin."""
+import asyncio
+import hashlib
 import json
 import logging
 import os
+import re
+import threading
+import time
+from collections.abc import AsyncIterator, Callable, Iterable
+from contextlib import asynccontextmanager
+from itertools import islice
 from typing import Any
 from urllib.request import urlopen
 
@@ -10,36 +18,188 @@ from fastapi import Depends, FastAPI, HTTPException, Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer
 from fastapi_pagination import add_pagination
 from jwcrypto.jwk import JWK
+from jwt import PyJWK
 from nameko.exceptions import RemoteError
+from myem_lib.caches import TtlLruCache
+from myem_lib.fast_api_middlewares import (
+    CompressionMiddleware,
+    DEFAULT_COMPRESSED_CONTENT_TYPES,
+    ETagMiddleware,
+)
+from myem_lib.fast_api_responses import ORJSONResponse
+from myem_lib.instrumentation import InstrumentationMiddleware, metrics, phase_timer
 
 
 class RPCValidationException(Exception):
     """RPC Validation Exception."""
 
 
-public_key_web_content = None
+def get_max_age(cache_control: str | None) -> float | None:
+    """Get the max-age of a Cache-Control header, 0 if the response must not be cached."""
+    if not cache_control:
+        return None
+    if re.search(r"no-cache|no-store", cache_control):
+        return 0
+    if match := re.search(r"max-age=(\d+)", cache_control):
+        return float(match.group(1))
+    return None
 
-if public_key_url := os.environ["PUBLIC_KEY_URL"] if os.getenv("PUBLIC_KEY_URL") else None:
-    with urlopen(os.environ["PUBLIC_KEY_URL"]) as f:
-        public_key_web_content = json.loads(f.read())["keys"]
+
+def fetch_public_keys(url: str, timeout: float) -> tuple[list[dict[str, Any]], float | None]:
+    """Fetch a JWKS, returns its keys and the max-age of its cache headers."""
+    # we used urllib rather than requests because it's has an incompabilities with
+    # fast api or other you can check the same error in this link
+    # https://stackoverflow.com/questions/49820173/requests-recursionerror-maximum-recursion-depth-exceeded
+    with urlopen(url, timeout=timeout) as f:
+        return json.loads(f.read())["keys"], get_max_age(f.headers.get("Cache-Control"))
+
+
+def read_public_keys(path: str) -> list[dict[str, Any]]:
+    """Read the keys of a JWKS file."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["keys"]
+
+
+class PublicKeyRing:
+    """Public Key Ring.
+
+    Parses each key of a JWKS once into a key object ready to verify tokens, keys are indexed
+    by kid and by position.
+    """
+
+    def __init__(self, jwks: list[dict[str, Any]]) -> None:
+        self.jwks = jwks
+        self.kids = {jwk["kid"]: index for index, jwk in enumerate(jwks) if jwk.get("kid")}
+        self.keys: dict[int, Any] = {}
+        self.pems: dict[int, Any] = {}
+
+    def get_key(self, kid: str | None = None, index: int = 0) -> Any:
+        """Get the verifying key of a kid, or of an index if the kid is unknown."""
+        index = self.kids.get(kid, index) if kid else index
+        if (key := self.keys.get(index)) is None:
+            # the key type is inferred from the alg or kty of the jwk (RSA, EC or OKP keys)
+            key = PyJWK(self.jwks[index]).key
+            # tokens are verified with the public key, even if the jwk contains a private one
+            if hasattr(key, "public_key"):
+                key = key.public_key()
+            self.keys[index] = key
+        return key
+
+    def get_pem(self, index: int = 0) -> Any:
+        """Get the public key of an index as PEM."""
+        if (pem := self.pems.get(index)) is None:
+            pem = self.pems[index] = JWK(**self.jwks[index]).export_to_pem()
+        return pem
+
+
+class VerifiedTokenCache:
+    """Verified Token Cache.
+
+    LRU of the claims of verified tokens keyed by a hash of the token, of at most maxsize tokens
+    cached until their exp and for at most ttl seconds. The cache is cleared when the key ring
+    changes.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300) -> None:
+        # exp is a timestamp, tokens expire in wall time
+        self.tokens = TtlLruCache(maxsize, ttl, clock=time.time)
+        self.key_ring: PublicKeyRing | None = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_cache_key(token: str, *args: Any) -> str:
+        """Get the cache key of a token verified with args."""
+        return hashlib.sha256(repr((token, *args)).encode()).hexdigest()
+
+    def get(self, key_ring: PublicKeyRing, token: str, *args: Any) -> dict[str, Any] | None:
+        """Get the claims of a token verified with args by the keys of a key ring."""
+        cache_key = self.get_cache_key(token, *args)
+        with self.lock:
+            if key_ring is not self.key_ring:
+                self.tokens.clear()
+                self.key_ring = key_ring
+            if (claims := self.tokens.get(cache_key)) is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return dict(claims)
+
+    def set(self, key_ring: PublicKeyRing, token: str, claims: dict[str, Any], *args: Any) -> None:
+        """Cache the claims of a token verified with args by the keys of a key ring."""
+        expires_at = exp if isinstance(exp := claims.get("exp"), (int, float)) else None
+        cache_key = self.get_cache_key(token, *args)
+        with self.lock:
+            if key_ring is not self.key_ring:
+                return
+            self.tokens.set(cache_key, dict(claims), expires_at)
+
+    def clear(self) -> None:
+        """Remove all the cached tokens."""
+        with self.lock:
+            self.tokens.clear()
+
+    def get_stats(self) -> dict[str, int]:
+        """Get the hits, misses and size of the cache."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.tokens)}
 
 
 class FastApiSettingsMixin:
     """FastApi settings mixin."""
 
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-    public_key_web_content = public_key_web_content
+    # keys are fetched from public_key_url on first use and refreshed during the app lifespan,
+    # public_key_file preloads them for an offline startup.
+    public_key_url = os.getenv("PUBLIC_KEY_URL")
+    public_key_file = os.getenv("PUBLIC_KEY_FILE")
+    public_key_web_content: list[dict[str, Any]] | None = None
+    public_key_ring: PublicKeyRing | None = None
+    # seconds
+    public_key_fetch_timeout = float(os.getenv("PUBLIC_KEY_FETCH_TIMEOUT", "10"))
+    # used when the JWKS response has no cache headers
+    public_key_refresh_interval = float(os.getenv("PUBLIC_KEY_REFRESH_INTERVAL", "3600"))
+    # minimum time between two fetches, unknown kids can't trigger more fetches than that
+    public_key_min_refresh_interval = float(os.getenv("PUBLIC_KEY_MIN_REFRESH_INTERVAL", "60"))
+    public_key_max_age: float | None = None
+    public_keys_fetched_at: float | None = None
+    public_keys_lock = threading.Lock()
+    # audiences accepted in the aud claim of tokens, tokens without aud are accepted
+    accepted_audiences: tuple[str, ...] = ("fastapi-users:auth",)
+    # set to ORJSONResponse to serialize the responses of the app with orjson
+    default_response_class: type[JSONResponse] | None = None
+    # compress the responses of at least this size in bytes with gzip, or brotli if installed
+    compression_minimum_size: int | None = None
+    compression_content_types: tuple[str, ...] = DEFAULT_COMPRESSED_CONTENT_TYPES
+    # add ETags to the responses and answer 304 to the requests having a matching If-None-Match
+    etag = False
+    # record the latency of the routes and the time spent in their auth, db, rpc and encoding
+    # phases, exposed on metrics_path and in Server-Timing headers
+    instrumentation = False
+    metrics_path = "/metrics"
+    # requests having this header are profiled when set, e.g. "X-Profile"
+    profile_header: str | None = None
+    # maximum number of validation errors reported by the validation exception handler
+    validation_errors_limit: int | None = None
+    # set to a VerifiedTokenCache to skip the signature verification of recently verified tokens
+    verified_token_cache: VerifiedTokenCache | None = None
 
     @classmethod
     def init_app(cls, app: FastAPI) -> None:
         """Init fast api app."""
+        if cls.default_response_class is not None:
+            # used by the routes added after init_app that don't set their response class
+            app.router.default_response_class = cls.default_response_class
+        cls.add_public_keys_lifespan(app)
         cls.add_middleware(app)
         cls.add_validation_exception_handler(app)
         cls.add_rpc_remote_validation_exception_handler(app)
+        if cls.instrumentation:
+            cls.add_instrumentation(app)
         add_pagination(app)
 
     @classmethod
@@ -51,8 +211,8 @@ class FastApiSettingsMixin:
         @app.exception_handler(remote_rpc_exc)
         async def http_exception_handler(request: Any, exc: Any) -> JSONResponse:
             if exc.exc_type == "RPCValidationException":
-                return JSONResponse({"detail": exc.value}, status_code=status.HTTP_400_BAD_REQUEST)
-            return JSONResponse(
+                return cls.json_response({"detail": exc.value}, status.HTTP_400_BAD_REQUEST)
+            return cls.json_response(
                 {"detail": "Erreur interne du serveur"},
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
@@ -66,29 +226,49 @@ class FastApiSettingsMixin:
             request: Request, exc: RequestValidationError
         ) -> JSONResponse:
             """Override validation_exception_handler."""
-            errors: Any = []
-            for e in exc.errors():
-                new_dict = current = {}
+            errors = cls.format_validation_errors(exc.errors(), cls.validation_errors_limit)
+            return cls.json_response({"errors": errors}, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    @classmethod
+    def json_response(cls, content: Any, status_code: int = status.HTTP_200_OK) -> JSONResponse:
+        """Get a response of the default response class, JSONResponse if not set."""
+        response_class = cls.default_response_class or JSONResponse
+        if not issubclass(response_class, ORJSONResponse):
+            with phase_timer("encoding"):
+                content = jsonable_encoder(content)
+        return response_class(content, status_code=status_code)
+
+    @staticmethod
+    def format_validation_errors(
+        validation_errors: Iterable[dict[str, Any]], limit: int | None = None
+    ) -> list[dict[str, Any]]:
+        """Nest the messages of validation errors by location, grouped by top level location.
+
+        Only the first limit errors are reported when a limit is set.
+        """
+        errors: list[dict[str, Any]] = []
+        errors_by_loc: dict[str, dict[str, Any]] = {}
+        for e in islice(validation_errors, limit):
+            loc = e["loc"]
+            if len(loc) > 1 and (current := errors_by_loc.get(str(loc[1]))) is not None:
+                existed = True
+            else:
+                current = {}
                 existed = False
-                for item in errors:
-                    if str(e["loc"][1]) == list(item.keys())[0]:
-                        new_dict = current = item
-                        existed = True
-                        break
-                for i in range(1, len(e["loc"])):
-                    if i == len(e["loc"]) - 1:
-                        current[str(e["loc"][i])] = e["msg"]
-                    elif current.get(str(e["loc"][i])):
-                        current = current[str(e["loc"][i])]
-                    else:
-                        current[str(e["loc"][i])] = {}
-                        current = current[str(e["loc"][i])]
-                if not existed:
-                    errors.append(new_dict)
-            return JSONResponse(
-                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-                content=jsonable_encoder({"errors": errors}),
-            )
+            new_dict = current
+            for i in range(1, len(loc)):
+                if i == len(loc) - 1:
+                    current[str(loc[i])] = e["msg"]
+                elif current.get(str(loc[i])):
+                    current = current[str(loc[i])]
+                else:
+                    current[str(loc[i])] = {}
+                    current = current[str(loc[i])]
+            if not existed:
+                errors.append(new_dict)
+                if len(loc) > 1:
+                    errors_by_loc.setdefault(str(loc[1]), new_dict)
+        return errors
 
     @classmethod
     def add_middleware(cls, app: FastAPI) -> None:
@@ -100,16 +280,123 @@ class FastApiSettingsMixin:
             allow_methods=["*"],
             allow_headers=["*"],
         )
+        if cls.etag:
+            app.add_middleware(ETagMiddleware)
+        if cls.compression_minimum_size is not None:
+            app.add_middleware(
+                CompressionMiddleware,
+                minimum_size=cls.compression_minimum_size,
+                content_types=cls.compression_content_types,
+            )
+
+    @classmethod
+    def add_public_keys_lifespan(cls, app: FastAPI) -> None:
+        """Fetch and refresh the public keys in the background while the app runs."""
+        lifespan_context = app.router.lifespan_context
+
+        @asynccontextmanager
+        async def lifespan(app: Any) -> AsyncIterator[Any]:
+            task = asyncio.create_task(cls.refresh_public_keys())
+            try:
+                async with lifespan_context(app) as state:
+                    yield state
+            finally:
+                task.cancel()
+
+        app.router.lifespan_context = lifespan
+
+    @classmethod
+    async def refresh_public_keys(cls) -> None:
+        """Fetch the public keys now, then each time they expire."""
+        force = True
+        while True:
+            loaded = await asyncio.to_thread(cls.load_public_keys, force)
+            force = False
+            interval = cls.public_key_min_refresh_interval
+            if loaded:
+                max_age = cls.public_key_max_age
+                interval = max(
+                    interval, cls.public_key_refresh_interval if max_age is None else max_age
+                )
+            await asyncio.sleep(interval)
+
+    @classmethod
+    def load_public_keys(cls, force: bool = False) -> bool:
+        """Fetch the public keys from public_key_url, returns whether they were fetched.
+
+        Fetches are single flight, concurrent calls wait for the running fetch instead of sending
+        their own, and unless forced at most one fetch is done per public_key_min_refresh_interval.
+        """
+        if not cls.public_key_url:
+            return False
+        called_at = time.monotonic()
+        with cls.public_keys_lock:
+            if (fetched_at := cls.public_keys_fetched_at) is not None:
+                if fetched_at > called_at:
+                    return cls.public_key_web_content is not None
+                if not force and called_at - fetched_at < cls.public_key_min_refresh_interval:
+                    return False
+            cls.public_keys_fetched_at = time.monotonic()
+            try:
+                keys, cls.public_key_max_age = fetch_public_keys(
+                    cls.public_key_url, cls.public_key_fetch_timeout
+                )
+            except Exception as e:
+                logging.warning(f"Could not fetch public keys from {cls.public_key_url}: {e}")
+                return False
+            cls.public_key_web_content = keys
+            return True
+
+    @classmethod
+    def get_public_keys(cls) -> list[dict[str, Any]]:
+        """Get the public keys, loaded from public_key_file or public_key_url on first use."""
+        if cls.public_key_web_content is None:
+            if cls.public_key_file:
+                cls.public_key_web_content = read_public_keys(cls.public_key_file)
+            else:
+                cls.load_public_keys()
+        return cls.public_key_web_content or []
+
+    @classmethod
+    def add_instrumentation(cls, app: FastAPI) -> None:
+        """Record the latencies and phase timings of the requests, exposed on metrics_path."""
+        app.add_middleware(InstrumentationMiddleware, profile_header=cls.profile_header)
+
+        async def get_metrics(request: Request) -> PlainTextResponse:
+            return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+        app.add_route(cls.metrics_path, get_metrics, include_in_schema=False)
+
+    @classmethod
+    def get_public_key_ring(cls) -> PublicKeyRing:
+        """Get the key ring of the public keys, rebuilt when public_key_web_content changes."""
+        public_keys = cls.get_public_keys()
+        if cls.public_key_ring is None or cls.public_key_ring.jwks is not public_keys:
+            cls.public_key_ring = PublicKeyRing(public_keys)
+        return cls.public_key_ring
 
     @classmethod
     def get_public_key(cls, index: int = 0) -> str:
         """Returns a public key from a url contains a decoded header and a token."""
-        # we used urllib rather than requests because it's has an incompabilities with
-        # fast api or other you can check the same error in this link
-        # https://stackoverflow.com/questions/49820173/requests-recursionerror-maximum-recursion-depth-exceeded
         try:
-            header_key = cls.public_key_web_content[index]
-            return JWK(**header_key).export_to_pem()
+            return cls.get_public_key_ring().get_pem(index)
+        except Exception:
+            raise HTTPException(detail="Invalid Key", status_code=400) from Exception
+
+    @classmethod
+    def get_verifying_key(cls, token: str, index: int = 0) -> Any:
+        """Returns the key verifying a token, selected by the kid of its header or by index."""
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+        except jwt.exceptions.PyJWTError:
+            kid = None
+        try:
+            key_ring = cls.get_public_key_ring()
+            # an unknown kid may have been added by a key rotation since the last fetch
+            if kid and kid not in key_ring.kids:
+                cls.load_public_keys()
+                key_ring = cls.get_public_key_ring()
+            return key_ring.get_key(kid, index)
         except Exception:
             raise HTTPException(detail="Invalid Key", status_code=400) from Exception
 
@@ -117,7 +404,7 @@ class FastApiSettingsMixin:
     def get_private_key(cls, index: int = 0) -> str:
         """Returns a private key from a url contains a decoded header and a token."""
         try:
-            header_key = cls.public_key_web_content[index]
+            header_key = cls.get_public_keys()[index]
             return JWK(**header_key).export_to_pem(private_key=True, password=None)
         except Exception:
             raise HTTPException(detail="unauthorized", status_code=401) from Exception
@@ -130,21 +417,90 @@ class FastApiSettingsMixin:
         index: int = 0,
     ) -> dict["str", Any]:
         """Decode a jwt token."""
-        try:
-            decoded_token = jwt.decode(token, cls.get_public_key(index), algorithms=["RS256"])
-        except jwt.exceptions.InvalidAudienceError:
-            # fast-api users specify the audience for some reason and that break our decode function
-            # to solve this we will try to decode our token for simple users if it raise an
-            # jwt.exceptions.InvalidAudienceError we decode the token with a specified audience
-            try:
-                decoded_token = jwt.decode(
-                    token, cls.get_public_key(index), audience=audience, algorithms=["RS256"]
-                )
-            except Exception as e:
-                logging.warning(f"Could not decode token {e.args[0]}")
-                raise HTTPException(detail="unauthorized", status_code=401) from Exception
-        except Exception as e:
-            logging.warning(f"Could not decode token {e.args[0]}")
-            raise HTTPException(detail="unauthorized", status_code=401) from Exception
+        # fast-api users tokens specify an audience, tokens without audience are also accepted
+        return cls.decode_token(token, audiences=(audience,), index=index)
+
+    @classmethod
+    def decode_token(
+        cls,
+        token: str,
+        *,
+        audiences: Iterable[str] | None = None,
+        index: int = 0,
+        algorithms: Iterable[str] = ("RS256",),
+        required_claims: Iterable[str] = (),
+        roles: Iterable[str] | None = None,
+    ) -> dict[str, Any]:
+        """Verify a jwt token once and check its audience, required claims and role.
+
+        A token audience must be one of audiences, accepted_audiences by default, and its role
+        one of roles when set.
+        """
+        with phase_timer("auth"):
+            audiences = tuple(cls.accepted_audiences if audiences is None else audiences)
+            algorithms = tuple(algorithms)
+            required_claims = tuple(required_claims)
+            args = (audiences, index, algorithms, required_claims)
+            decoded_token = None
+            if cache := cls.verified_token_cache:
+                key_ring = cls.get_public_key_ring()
+                decoded_token = cache.get(key_ring, token, *args)
+            if decoded_token is None:
+                key = cls.get_verifying_key(token, index)
+                try:
+                    decoded_token = jwt.decode(
+                        token,
+                        key,
+                        algorithms=list(algorithms),
+                        options={"verify_aud": False, "require": list(required_claims)},
+                    )
+                except Exception as e:
+                    logging.warning(f"Could not decode token {e.args[0]}")
+                    raise HTTPException(detail="unauthorized", status_code=401) from Exception
+                if (audience := decoded_token.get("aud")) is not None:
+                    if not set([audience] if isinstance(audience, str) else audience) & set(
+                        audiences
+                    ):
+                        logging.warning(f"Could not decode token Invalid audience {audience}")
+                        raise HTTPException(detail="unauthorized", status_code=401)
+                if cache:
+                    cache.set(key_ring, token, decoded_token, *args)
+
+            if roles is not None:
+                role = decoded_token.get("role")
+                if not set([role] if isinstance(role, str) else role or []) & set(roles):
+                    raise HTTPException(detail="forbidden", status_code=403)
+            return decoded_token
+
+    @classmethod
+    def get_token_dependency(
+        cls,
+        audiences: Iterable[str] | None = None,
+        algorithms: Iterable[str] = ("RS256",),
+        required_claims: Iterable[str] = ("exp",),
+        roles: Iterable[str] | None = None,
+    ) -> Callable[[str], dict[str, Any]]:
+        """Get a dependency decoding the bearer token with decode_token.
+
+        Example:
+            get_admin = Settings.get_token_dependency(required_claims=["exp", "role"], roles=["admin"])
+
+            @app.get("/admin")
+            def admin(user: dict = Depends(get_admin)) -> Any:
+                ...
+        """
+        audiences = tuple(cls.accepted_audiences if audiences is None else audiences)
+        algorithms = tuple(algorithms)
+        required_claims = tuple(required_claims)
+        roles = None if roles is None else tuple(roles)
+
+        def get_token(token: str = Depends(cls.oauth2_scheme)) -> dict[str, Any]:
+            return cls.decode_token(
+                token,
+                audiences=audiences,
+                algorithms=algorithms,
+                required_claims=required_claims,
+                roles=roles,
+            )
 
-        return decoded_token
+        return get_token
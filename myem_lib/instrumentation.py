@@ -0,0 +1,410 @@
+"""Instrumentation."""
+import cProfile
+import io
+import logging
+import pstats
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any
+from weakref import WeakValueDictionary
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# bytes
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+# time spent per phase (auth, db, rpc, encoding) by the current request, None when the request is
+# not instrumented so that phase timers cost a single context variable lookup.
+request_timings: ContextVar[dict[str, float] | None] = ContextVar("request_timings", default=None)
+
+# trace id of the current request, sent in the context data of its instrumented rpc calls
+trace_id: ContextVar[str | None] = ContextVar("trace_id", default=None)
+
+
+@contextmanager
+def phase_timer(phase: str) -> Iterator[None]:
+    """Add the time spent in the block to a phase of the current request, if instrumented."""
+    if (timings := request_timings.get()) is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0) + time.perf_counter() - start
+
+
+def timed(phase: str, func: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap a function to add the time spent in its calls to a phase of the current request."""
+
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if request_timings.get() is None:
+            return func(*args, **kwargs)
+        with phase_timer(phase):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def instrument_rpc_client(client: Any) -> Any:
+    """Add the time spent publishing calls and waiting for replies of a nameko Client to rpc."""
+    register_for_reply = client.register_for_reply
+    client.publish = timed("rpc", client.publish)
+    client.register_for_reply = lambda correlation_id: timed(
+        "rpc", register_for_reply(correlation_id)
+    )
+    return client
+
+
+class RpcCallRecord:
+    """Rpc Call Record.
+
+    Target, trace id, start time and sizes of an instrumented rpc call.
+    """
+
+    def __init__(self) -> None:
+        self.routing_key = "*.*"
+        self.trace_id: str | None = None
+        self.start = time.perf_counter()
+        self.request_size = 0
+        self.response_size: int | None = None
+
+
+def instrument_rpc_calls(
+    client: Any,
+    reply_listener: Any,
+    serializer: str,
+    registry: "MetricsRegistry | None" = None,
+    slow_call_threshold: float | None = None,
+) -> Any:
+    """Record the latency, sizes and outcome of the rpc calls of a nameko Client in a registry.
+
+    Calls slower than slow_call_threshold seconds are logged. The trace id of the current request,
+    or a new one, is sent in the context data of the calls that don't have one. The reply
+    listener must not be started yet.
+    """
+    # pylint: disable=import-outside-toplevel
+    from kombu.serialization import dumps
+    from nameko.constants import HEADER_PREFIX
+    from nameko.exceptions import RpcTimeout
+
+    registry = metrics if registry is None else registry
+    registry.set_buckets("rpc_client_request_size_bytes", SIZE_BUCKETS)
+    registry.set_buckets("rpc_client_response_size_bytes", SIZE_BUCKETS)
+    trace_header = f"{HEADER_PREFIX}.trace_id"
+    # records are dropped with the rpc calls that are never waited for
+    calls: WeakValueDictionary[str, RpcCallRecord] = WeakValueDictionary()
+    publish = client.publish
+    register_for_reply = client.register_for_reply
+    handle_message = reply_listener.handle_message
+
+    def record(call: RpcCallRecord, status: str) -> None:
+        duration = time.perf_counter() - call.start
+        service, _, method = call.routing_key.partition(".")
+        registry.observe(
+            "rpc_client_duration_seconds",
+            duration,
+            "Duration of the rpc calls.",
+            service=service,
+            method=method,
+            status=status,
+        )
+        registry.observe(
+            "rpc_client_request_size_bytes",
+            call.request_size,
+            "Size of the rpc requests.",
+            service=service,
+            method=method,
+        )
+        if call.response_size is not None:
+            registry.observe(
+                "rpc_client_response_size_bytes",
+                call.response_size,
+                "Size of the rpc replies.",
+                service=service,
+                method=method,
+            )
+        if slow_call_threshold is not None and duration >= slow_call_threshold:
+            logging.warning(
+                f"Slow rpc call {call.routing_key} ({status}) took {duration:.3f}s,"
+                f" trace id {call.trace_id}"
+            )
+
+    def publish_call(payload: Any, **kwargs: Any) -> Any:
+        extra_headers = kwargs.get("extra_headers") or {}
+        if trace_header not in extra_headers:
+            extra_headers = kwargs["extra_headers"] = {
+                **extra_headers,
+                trace_header: trace_id.get() or uuid.uuid4().hex,
+            }
+        if (call := calls.get(kwargs.get("correlation_id", ""))) is not None:
+            call.routing_key = kwargs.get("routing_key", call.routing_key)
+            call.trace_id = extra_headers[trace_header]
+            # the payload is serialized here to measure its body, kombu publishes the body as is
+            content_type, content_encoding, body = dumps(
+                payload, kwargs.get("serializer", serializer)
+            )
+            if isinstance(body, str):
+                body = body.encode(content_encoding)
+            call.request_size = len(body)
+            call.start = time.perf_counter()
+            return publish(
+                body, content_type=content_type, content_encoding=content_encoding, **kwargs
+            )
+        return publish(payload, **kwargs)
+
+    def register_call(correlation_id: str) -> Callable[[], Any]:
+        get_response = register_for_reply(correlation_id)
+        call = calls[correlation_id] = RpcCallRecord()
+
+        def get_recorded_response() -> Any:
+            status = "error"
+            try:
+                response = get_response()
+                status = "error" if response.get("error") else "ok"
+                return response
+            except RpcTimeout:
+                status = "timeout"
+                raise
+            finally:
+                record(call, status)
+
+        return get_recorded_response
+
+    def handle_reply(body: Any, message: Any) -> None:
+        if (call := calls.get(message.properties.get("correlation_id", ""))) is not None:
+            call.response_size = len(message.body)
+        handle_message(body, message)
+
+    client.publish = publish_call
+    client.register_for_reply = register_call
+    reply_listener.handle_message = handle_reply
+    return client
+
+
+def instrument_engine(engine: Any) -> Any:
+    """Add the time spent executing the statements of a sqlalchemy engine to db."""
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn: Any, *args: Any) -> None:
+        if request_timings.get() is not None:
+            conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn: Any, *args: Any) -> None:
+        if (timings := request_timings.get()) is not None and conn.info.get("query_start_times"):
+            duration = time.perf_counter() - conn.info["query_start_times"].pop()
+            timings["db"] = timings.get("db", 0) + duration
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    return engine
+
+
+class Histogram:
+    """Histogram.
+
+    Cumulative counts of observed values per bucket upper bound, with their sum and count.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Observe a value."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def escape_label_value(value: str) -> str:
+    """Escape a label value in the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    """Format labels in the Prometheus text format."""
+    return ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels)
+
+
+class MetricsRegistry:
+    """Metrics Registry.
+
+    Histograms by name and labels, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        # buckets of the histograms of a name, instead of the default ones
+        self.name_buckets: dict[str, tuple[float, ...]] = {}
+        self.histograms: dict[str, dict[tuple[tuple[str, str], ...], Histogram]] = {}
+        self.descriptions: dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def set_buckets(self, name: str, buckets: tuple[float, ...]) -> None:
+        """Set the buckets of the histograms of a name, before its first observation."""
+        self.name_buckets[name] = buckets
+
+    def observe(self, name: str, value: float, description: str = "", **labels: Any) -> None:
+        """Observe a value in the histogram of a name and labels."""
+        key = tuple((label, str(label_value)) for label, label_value in labels.items())
+        with self.lock:
+            if (histograms := self.histograms.get(name)) is None:
+                histograms = self.histograms[name] = {}
+                self.descriptions[name] = description
+            if (histogram := histograms.get(key)) is None:
+                histogram = histograms[key] = Histogram(self.name_buckets.get(name, self.buckets))
+            histogram.observe(value)
+
+    def render(self) -> str:
+        """Render the histograms in the Prometheus text format."""
+        lines = []
+        with self.lock:
+            for name, histograms in self.histograms.items():
+                lines.append(f"# HELP {name} {self.descriptions[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in histograms.items():
+                    labels = format_labels(key)
+                    separator = "," if labels else ""
+                    count = 0
+                    for bucket, bucket_count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                        count += bucket_count
+                        lines.append(f'{name}_bucket{{{labels}{separator}le="{bucket}"}} {count}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def profile_request(scope: Scope) -> Iterator[None]:
+    """Profile a request and log its profile, with pyinstrument if installed, else cProfile.
+
+    Only the code running in the event loop thread is profiled, not sync endpoints and
+    dependencies that run in the thread pool.
+    """
+    try:
+        # pylint: disable=import-outside-toplevel
+        # pyinstrument is an optional dependency, it's a sampling profiler
+        from pyinstrument import Profiler
+
+        sampling = True
+    except ImportError:
+        sampling = False
+    if not sampling:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(30)
+            logging.info(f"Profile of {scope['method']} {scope['path']}\n{output.getvalue()}")
+        return
+    sampling_profiler = Profiler(interval=0.001, async_mode="enabled")
+    sampling_profiler.start()
+    try:
+        yield
+    finally:
+        sampling_profiler.stop()
+        logging.info(
+            f"Profile of {scope['method']} {scope['path']}\n{sampling_profiler.output_text()}"
+        )
+
+
+class InstrumentationMiddleware:
+    """Instrumentation Middleware.
+
+    Records the latency of each route and the time spent in the auth, db, rpc and encoding phases
+    of its requests in a metrics registry, and sends them in a Server-Timing header. Requests with
+    the profile header are profiled when it's set. The trace id of a request is the value of its
+    trace header, or a new one, and is sent back in the trace header of the response.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        registry: MetricsRegistry = metrics,
+        profile_header: str | None = None,
+        profiler: Callable[[Scope], Any] = profile_request,
+        trace_header: str = "X-Request-ID",
+    ) -> None:
+        self.app = app
+        self.registry = registry
+        self.profile_header = profile_header
+        self.profiler = profiler
+        self.trace_header = trace_header
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Instrument a request."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings: dict[str, float] = {}
+        token = request_timings.set(timings)
+        request_headers = Headers(scope=scope)
+        request_trace_id = request_headers.get(self.trace_header) or uuid.uuid4().hex
+        trace_token = trace_id.set(request_trace_id)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timings(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                timings["total"] = time.perf_counter() - start
+                headers = MutableHeaders(raw=message["headers"])
+                headers.append(
+                    "Server-Timing",
+                    ", ".join(
+                        f"{phase};dur={value * 1000:.2f}" for phase, value in timings.items()
+                    ),
+                )
+                del timings["total"]
+                if self.trace_header not in headers:
+                    headers[self.trace_header] = request_trace_id
+            await send(message)
+
+        try:
+            if self.profile_header and self.profile_header in request_headers:
+                with self.profiler(scope):
+                    await self.app(scope, receive, send_with_timings)
+            else:
+                await self.app(scope, receive, send_with_timings)
+        finally:
+            request_timings.reset(token)
+            trace_id.reset(trace_token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.registry.observe(
+                "http_request_duration_seconds",
+                time.perf_counter() - start,
+                "Duration of the http requests.",
+                method=scope["method"],
+                route=route,
+                status=status_code,
+            )
+            for phase, value in timings.items():
+                self.registry.observe(
+                    "http_request_phase_duration_seconds",
+                    value,
+                    "Time spent by the http requests in each phase.",
+                    route=route,
+                    phase=phase,
+                )
@@ -1,9 +1,57 @@
 """Nameko Settings Mixins."""
+import asyncio
+import contextvars
+import copy
+import hashlib
+import logging
 import os
+import socket
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Collection, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from functools import partial
 from typing import Any
 
+from amqp.exceptions import ConnectionError as AMQPConnectionError
 from nameko import config
-from nameko.standalone.rpc import ClusterRpcClient
+from nameko.constants import CALL_ID_STACK_CONTEXT_KEY
+from nameko.exceptions import deserialize, MethodNotFound, RpcTimeout, serialize
+from nameko.extensions import ENTRYPOINT_EXTENSIONS_ATTR
+from nameko.rpc import Client, Rpc
+from nameko.standalone.rpc import ClusterRpcClient, ReplyListener
+from myem_lib.caches import TtlLruCache
+from myem_lib.instrumentation import instrument_rpc_calls, instrument_rpc_client
+from myem_lib.serializers import ACCEPTED_SERIALIZERS, SERIALIZERS_CONFIG
+
+
+# serializer used to send rpc calls, pickle by default, set RPC_SERIALIZER to myem-msgpack once
+# every service accepts it (both are accepted, messages are decoded by their content type).
+RPC_SERIALIZER = os.getenv("RPC_SERIALIZER", "pickle")
+
+# lease started clients from a process-wide pool per broker instead of starting a reply listener
+# per client, at most RPC_CLIENT_POOL_SIZE clients per broker.
+RPC_CLIENT_POOLED = os.getenv("RPC_CLIENT_POOLED", "false").lower() == "true"
+RPC_CLIENT_POOL_SIZE = int(os.getenv("RPC_CLIENT_POOL_SIZE", "10"))
+
+# record the latency, sizes and outcome of the rpc calls in instrumentation.metrics and send a
+# trace id in their context data, calls slower than RPC_SLOW_CALL_THRESHOLD seconds are logged.
+RPC_INSTRUMENTATION = os.getenv("RPC_INSTRUMENTATION", "false").lower() == "true"
+RPC_SLOW_CALL_THRESHOLD = float(os.getenv("RPC_SLOW_CALL_THRESHOLD", "1"))
+
+CONNECTION_ERRORS = (OSError, AMQPConnectionError)
+
+# entrypoint of the services using RpcBatchMixin, called by fan_out for batch services
+RPC_BATCH_METHOD = "rpc_batch"
+
+
+def setup_serialization_config(serializer: str) -> None:
+    """Set up nameko serialization config if it's not already set up."""
+    config["serializer"] = config.get("serializer", serializer)
+    config["SERIALIZERS"] = config.get("SERIALIZERS", SERIALIZERS_CONFIG)
+    config["ACCEPT"] = config.get("ACCEPT", ACCEPTED_SERIALIZERS)
 
 
 class NamekoSettingsMixin:
@@ -14,24 +62,578 @@ class NamekoSettingsMixin:
     backbone_rabbitmq_uri = os.getenv("BACKBONE_RABBITMQ_URI")
 
     network_cluster_rpc_proxy_config = {
-        "serializer": "pickle",
+        "serializer": RPC_SERIALIZER,
+        "SERIALIZERS": SERIALIZERS_CONFIG,
+        "ACCEPT": ACCEPTED_SERIALIZERS,
         "AMQP_URI": network_rabbitmq_uri,
     }
     backbone_cluster_rpc_proxy_config = {
-        "serializer": "pickle",
+        "serializer": RPC_SERIALIZER,
+        "SERIALIZERS": SERIALIZERS_CONFIG,
+        "ACCEPT": ACCEPTED_SERIALIZERS,
         "AMQP_URI": backbone_rabbitmq_uri,
     }
 
+    # maximum number of concurrent calls, and of clients, of each async rpc client
+    async_rpc_pool_size = int(os.getenv("ASYNC_RPC_POOL_SIZE", "10"))
+    network_async_rpc: "AsyncRpcClient | None" = None
+    backbone_async_rpc: "AsyncRpcClient | None" = None
+
+    @classmethod
+    def get_network_async_rpc(cls) -> "AsyncRpcClient":
+        """Get the async rpc client of the network, usable as a FastAPI dependency."""
+        if cls.network_async_rpc is None:
+            cls.network_async_rpc = AsyncRpcClient(NetworkClusterRpcClient, cls.async_rpc_pool_size)
+        return cls.network_async_rpc
+
+    @classmethod
+    def get_backbone_async_rpc(cls) -> "AsyncRpcClient":
+        """Get the async rpc client of the backbone, usable as a FastAPI dependency."""
+        if cls.backbone_async_rpc is None:
+            cls.backbone_async_rpc = AsyncRpcClient(
+                BackboneClusterRpcClient, cls.async_rpc_pool_size
+            )
+        return cls.backbone_async_rpc
+
+
+class PooledReplyListener(ReplyListener):
+    """Pooled Reply Listener.
+
+    Reply listener keeping its consumer connection open between calls, the nameko one connects
+    to the broker to wait for each reply. The connection is reopened when it's lost, replies
+    sent meanwhile wait in the reply queue.
+    """
+
+    consumer_context: ExitStack | None = None
+    connection: Any = None
+
+    def connect(self) -> None:
+        """Open the consumer connection."""
+        self.disconnect()
+        self.consumer_context = ExitStack()
+        self.connection, _, _ = self.consumer_context.enter_context(
+            self.consumer.consumer_context()
+        )
+
+    def disconnect(self) -> None:
+        """Close the consumer connection."""
+        if (consumer_context := self.consumer_context) is not None:
+            self.consumer_context = self.connection = None
+            try:
+                consumer_context.close()
+            except CONNECTION_ERRORS as e:
+                logging.warning(f"Could not close rpc reply connection: {e}")
+
+    def is_healthy(self) -> bool:
+        """Whether the consumer connection is open, a heartbeat is sent if it's due."""
+        if self.connection is None or not self.connection.connected:
+            return False
+        try:
+            self.connection.heartbeat_check()
+        except CONNECTION_ERRORS:
+            return False
+        return True
+
+    def consume_reply(self, correlation_id: str) -> Any:
+        """Consume from the reply queue until the reply of correlation_id is received."""
+        if self.consumer.should_stop:
+            raise RuntimeError("Stopped and can no longer be used")
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not self.pending.get(correlation_id):
+            remaining = 1.0 if deadline is None else min(1.0, deadline - time.monotonic())
+            if remaining <= 0:
+                raise RpcTimeout()
+            try:
+                if self.consumer_context is None:
+                    self.connect()
+                try:
+                    self.connection.drain_events(timeout=remaining)
+                except socket.timeout:
+                    self.connection.heartbeat_check()
+            except CONNECTION_ERRORS as e:
+                logging.warning(f"Rpc reply connection lost, reconnecting: {e}")
+                self.disconnect()
+        return self.pending.pop(correlation_id)
+
+    def stop(self) -> None:
+        """Close the consumer connection and stop."""
+        self.disconnect()
+        super().stop()
+
+
+class RpcClientPool:
+    """Rpc Client Pool.
+
+    Pool of at most max_size started cluster rpc clients of a broker, each client is leased by a
+    single thread or greenthread at a time. Clients idle for more than max_idle_time seconds are
+    health checked before being leased, and replaced when their connection is lost.
+    """
+
+    pools: dict[Any, "RpcClientPool"] = {}
+    pools_lock = threading.Lock()
+
+    def __init__(
+        self,
+        client_factory: Callable[[], ClusterRpcClient],
+        max_size: int = RPC_CLIENT_POOL_SIZE,
+        lease_timeout: float | None = None,
+        max_idle_time: float = 30,
+    ) -> None:
+        self.client_factory = client_factory
+        self.max_size = max_size
+        self.lease_timeout = lease_timeout
+        self.max_idle_time = max_idle_time
+        self.idle_clients: list[tuple[ClusterRpcClient, float]] = []
+        self.lock = threading.Lock()
+        self.semaphore = threading.BoundedSemaphore(max_size)
+
+    @classmethod
+    def get_pool(
+        cls, key: Any, client_factory: Callable[[], ClusterRpcClient], **options: Any
+    ) -> "RpcClientPool":
+        """Get the process-wide pool of a key, created on first use."""
+        with cls.pools_lock:
+            if (pool := cls.pools.get(key)) is None:
+                pool = cls.pools[key] = cls(client_factory, **options)
+        return pool
+
+    @classmethod
+    def close_all(cls) -> None:
+        """Stop the idle clients of every pool."""
+        with cls.pools_lock:
+            pools = list(cls.pools.values())
+        for pool in pools:
+            pool.close()
+
+    def start_client(self) -> ClusterRpcClient:
+        """Start a client with a pooled reply listener."""
+        cluster_rpc_client = self.client_factory()
+        cluster_rpc_client.start()
+        cluster_rpc_client.reply_listener.connect()
+        return cluster_rpc_client
+
+    @staticmethod
+    def stop_client(cluster_rpc_client: ClusterRpcClient) -> None:
+        """Stop a client, ignoring errors of a lost connection."""
+        try:
+            cluster_rpc_client.stop()
+        except Exception as e:
+            logging.warning(f"Could not stop rpc client: {e}")
+
+    def get_client(self) -> ClusterRpcClient:
+        """Get the most recently used healthy idle client, or start one."""
+        while True:
+            with self.lock:
+                if not self.idle_clients:
+                    break
+                cluster_rpc_client, idle_since = self.idle_clients.pop()
+            if (
+                time.monotonic() - idle_since < self.max_idle_time
+                or cluster_rpc_client.reply_listener.is_healthy()
+            ):
+                return cluster_rpc_client
+            self.stop_client(cluster_rpc_client)
+        return self.start_client()
+
+    @contextmanager
+    def lease(self, timeout: float | None = None) -> Iterator[ClusterRpcClient]:
+        """Lease a started client, waiting for its replies at most timeout seconds."""
+        if not self.semaphore.acquire(timeout=self.lease_timeout):
+            raise Exception(f"No rpc client available in the pool of {self.max_size} clients !")
+        try:
+            cluster_rpc_client = self.get_client()
+            reply_listener = cluster_rpc_client.reply_listener
+            reply_listener.timeout = timeout
+            try:
+                yield cluster_rpc_client
+            finally:
+                # replies of calls that were not waited for are discarded when received
+                reply_listener.pending.clear()
+                if reply_listener.is_healthy():
+                    with self.lock:
+                        self.idle_clients.append((cluster_rpc_client, time.monotonic()))
+                else:
+                    self.stop_client(cluster_rpc_client)
+        finally:
+            self.semaphore.release()
+
+    def close(self) -> None:
+        """Stop the idle clients."""
+        with self.lock:
+            idle_clients, self.idle_clients = self.idle_clients, []
+        for cluster_rpc_client, _ in idle_clients:
+            self.stop_client(cluster_rpc_client)
+
+
+class RpcBatchMixin:
+    """Rpc Batch Mixin.
+
+    Adds an entrypoint to nameko services to call several of their rpc methods in a single
+    request, used by the fan_out of cluster rpc clients for their batch services.
+    class MeterService(RpcBatchMixin):
+        name = "meter_service"
+    """
+
+    @Rpc.decorator
+    def rpc_batch(self, calls: list[tuple[str, dict[str, Any]]]) -> list[dict[str, Any]]:
+        """Call the (method, kwargs) of the service, replies are in the order of calls."""
+        responses = []
+        for method_name, kwargs in calls:
+            method = getattr(self, method_name, None)
+            entrypoints = getattr(method, ENTRYPOINT_EXTENSIONS_ATTR, ())
+            if method_name == RPC_BATCH_METHOD or not any(
+                isinstance(entrypoint, Rpc) for entrypoint in entrypoints
+            ):
+                responses.append({"result": None, "error": serialize(MethodNotFound(method_name))})
+                continue
+            try:
+                responses.append({"result": method(**kwargs), "error": None})  # type: ignore
+            except Exception as e:
+                responses.append({"result": None, "error": serialize(e)})
+        return responses
+
+
+class RpcResultCache:
+    """Rpc Result Cache.
+
+    LRU of the results of an rpc method keyed by a hash of the arguments, and of the context data
+    when per_context_data, of at most maxsize results cached for ttl seconds. Concurrent calls with
+    the same key while it's missing wait for the first one instead of sending the same call.
+    Errors are not cached, results are copied so that callers can't change the cached ones.
+    """
+
+    def __init__(self, ttl: float = 60, maxsize: int = 1024, per_context_data: bool = False):
+        self.per_context_data = per_context_data
+        self.results = TtlLruCache(maxsize, ttl)
+        self.calls: dict[str, Future[Any]] = {}
+        # results of calls sent before an invalidation are not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_cache_key(
+        self, args: tuple[Any, ...], kwargs: dict[str, Any], context_data: Any = None
+    ) -> str:
+        """Get the cache key of a call with args, kwargs and context data."""
+        if self.per_context_data and isinstance(context_data, dict):
+            # nameko adds the call id stack to the context data on each call
+            context_data = sorted(
+                item for item in context_data.items() if item[0] != CALL_ID_STACK_CONTEXT_KEY
+            )
+        key = (args, sorted(kwargs.items()), context_data if self.per_context_data else None)
+        return hashlib.sha256(repr(key).encode()).hexdigest()
+
+    def get_or_call(
+        self,
+        call: Callable[[], Any],
+        args: tuple[Any, ...],
+        kwargs: dict[str, Any],
+        context_data: Any = None,
+    ) -> Any:
+        """Get the cached result of a call, or make the call and cache its result."""
+        cache_key = self.get_cache_key(args, kwargs, context_data)
+        with self.lock:
+            # results can be None, the entry tells whether one is cached
+            if (entry := self.results.get_entry(cache_key)) is not None:
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+            # the call is being made by another thread when there is a future
+            generation = None
+            if (future := self.calls.get(cache_key)) is None:
+                future = self.calls[cache_key] = Future()
+                generation = self.generation
+        if generation is None:
+            return copy.deepcopy(future.result())
+        try:
+            result = call()
+        except BaseException as e:
+            with self.lock:
+                del self.calls[cache_key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.calls[cache_key]
+            if generation == self.generation:
+                self.results.set(cache_key, result)
+        future.set_result(result)
+        return copy.deepcopy(result)
+
+    def invalidate(
+        self,
+        args: tuple[Any, ...] = (),
+        kwargs: dict[str, Any] | None = None,
+        context_data: Any = None,
+    ) -> None:
+        """Remove the cached result of a call with args, kwargs and context data."""
+        cache_key = self.get_cache_key(args, kwargs or {}, context_data)
+        with self.lock:
+            self.generation += 1
+            self.results.pop(cache_key)
+
+    def clear(self) -> None:
+        """Remove all the cached results."""
+        with self.lock:
+            self.generation += 1
+            self.results.clear()
+
+    def get_stats(self) -> dict[str, float]:
+        """Get the hits, misses, hit rate and size of the cache."""
+        calls = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / calls if calls else 0.0,
+            "size": len(self.results),
+        }
+
+
+class CachingClient(Client):
+    """Caching Client.
+
+    Nameko client of which calls to the methods with a result cache are served by the cache,
+    call_async is never cached.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[..., Any],
+        register_for_reply: Callable[[str], Any],
+        context_data: Any,
+        *,
+        result_caches: dict[tuple[str, str], RpcResultCache],
+        service_name: str | None = None,
+        method_name: str | None = None,
+    ) -> None:
+        super().__init__(publish, register_for_reply, context_data, service_name, method_name)
+        self.result_caches = result_caches
+
+    def __getattr__(self, name: str) -> "CachingClient":
+        client = super().__getattr__(name)
+        return CachingClient(
+            client.publish,
+            client.register_for_reply,
+            client.context_data,
+            result_caches=self.result_caches,
+            service_name=client.service_name,
+            method_name=client.method_name,
+        )
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        """Call the method, through its result cache if it has one."""
+        if (cache := self.result_caches.get((self.service_name, self.method_name))) is None:
+            return super().__call__(*args, **kwargs)
+        call = partial(Client.__call__, self, *args, **kwargs)
+        return cache.get_or_call(call, args, kwargs, self.context_data)
+
+
+class PoolableClusterRpcClient(ClusterRpcClient):
+    """Poolable Cluster Rpc Client.
+
+    Cluster rpc client which, when pooled, leases a started client from the process-wide pool of
+    its broker and options on enter instead of starting its own reply listener.
+    The results of the methods declared with cache_method on a client class are cached by its
+    clients for all the calls except call_async and fan_out.
+    NetworkClusterRpcClient.cache_method("customer_center_service", "get_user_meters_guid", ttl=300)
+    """
+
+    result_caches: dict[tuple[str, str], RpcResultCache] = {}
+    reply_listener_cls: type[ReplyListener] = ReplyListener
+    reply_listener: ReplyListener
+    client: Client
+
+    def __init__(
+        self,
+        context_data: Any = None,
+        timeout: int | None = 70,
+        pooled: bool = RPC_CLIENT_POOLED,
+        instrumented: bool = RPC_INSTRUMENTATION,
+        **publisher_options: Any,
+    ) -> None:
+        """An override of Cluster Rpc Client to lease clients from a pool."""
+        self.pooled = pooled
+        self.instrumented = instrumented
+        self.timeout = timeout
+        self.publisher_options = dict(publisher_options)
+        self.pool_lease: Any = None
+        self.leased_client: ClusterRpcClient | None = None
+        super().__init__(context_data=context_data, timeout=timeout, **publisher_options)
+        if self.reply_listener_cls is not ReplyListener:
+            # ClusterRpcClient creates a ReplyListener itself, replaced by one of the same queue
+            self.reply_listener = self.reply_listener_cls(
+                self.reply_listener.queue, timeout=timeout, uri=self.amqp_uri, ssl=self.ssl
+            )
+            self.client = Client(
+                self.client.publish,
+                self.reply_listener.register_for_reply,
+                self.client.context_data,
+            )
+        if instrumented:
+            instrument_rpc_calls(
+                self.client,
+                self.reply_listener,
+                self.serializer,
+                slow_call_threshold=RPC_SLOW_CALL_THRESHOLD,
+            )
+        instrument_rpc_client(self.client)
+
+    @classmethod
+    def cache_method(
+        cls,
+        service_name: str,
+        method_name: str,
+        ttl: float = 60,
+        maxsize: int = 1024,
+        per_context_data: bool = False,
+    ) -> RpcResultCache:
+        """Cache the results of an idempotent method for the clients of this class."""
+        if "result_caches" not in cls.__dict__:
+            cls.result_caches = {}
+        cache = cls.result_caches[(service_name, method_name)] = RpcResultCache(
+            ttl, maxsize, per_context_data
+        )
+        return cache
+
+    def get_caching_client(self, client: Client) -> Client:
+        """Get a client sending calls with a client and the context data of this client."""
+        if not self.result_caches:
+            return Client(client.publish, client.register_for_reply, self.client.context_data)
+        return CachingClient(
+            client.publish,
+            client.register_for_reply,
+            self.client.context_data,
+            result_caches=self.result_caches,
+        )
+
+    def get_pool(self) -> RpcClientPool:
+        """Get the pool of the broker and options of this client."""
+        options = {**self.publisher_options, "instrumented": self.instrumented}
+        key = tuple(sorted((name, repr(value)) for name, value in options.items()))
+        return RpcClientPool.get_pool(key, lambda: PooledClusterRpcClient(pooled=False, **options))
+
+    def __enter__(self) -> Any:
+        if not self.pooled:
+            return self.get_caching_client(super().__enter__())
+        self.pool_lease = self.get_pool().lease(self.timeout)
+        self.leased_client = self.pool_lease.__enter__()
+        # calls are sent with the context data of this client
+        return self.get_caching_client(self.leased_client.client)
+
+    def __exit__(self, tpe: Any, value: Any, traceback: Any) -> None:
+        if not self.pooled:
+            super().__exit__(tpe, value, traceback)
+            return
+        pool_lease, self.pool_lease, self.leased_client = self.pool_lease, None, None
+        pool_lease.__exit__(tpe, value, traceback)
+
+    @staticmethod
+    def get_fan_out_requests(
+        calls: list[tuple[str, str, dict[str, Any]]], batch_services: Collection[str]
+    ) -> list[tuple[list[int], str, str, dict[str, Any]]]:
+        """Get the (indexes of the calls, service, method, kwargs) requests of calls.
+
+        The calls to a batch service are packed in a single request to its batch entrypoint.
+        """
+        requests = []
+        batches: dict[str, list[int]] = {}
+        for index, (service_name, method_name, kwargs) in enumerate(calls):
+            if service_name in batch_services:
+                batches.setdefault(service_name, []).append(index)
+            else:
+                requests.append(([index], service_name, method_name, kwargs))
+        for service_name, indexes in batches.items():
+            batch_calls = [(calls[index][1], calls[index][2]) for index in indexes]
+            requests.append((indexes, service_name, RPC_BATCH_METHOD, {"calls": batch_calls}))
+        return requests
+
+    def fan_out(
+        self,
+        calls: Iterable[tuple[str, str, dict[str, Any]]],
+        max_concurrency: int = 10,
+        timeout: float | None = None,
+        return_exceptions: bool = True,
+        batch_services: Collection[str] = (),
+    ) -> list[Any]:
+        """Call many (service, method, kwargs) concurrently, results are in the order of calls.
+
+        At most max_concurrency calls wait for their reply at a time, each one at most timeout
+        seconds (the client timeout by default) from the time it's sent. The exception of a failed
+        call is its result when return_exceptions is true, else the first one is raised once every
+        call is done. The calls to batch_services, which must expose the RpcBatchMixin entrypoint,
+        are sent in a single request per service.
+        results = NetworkClusterRpcClient().fan_out(
+            ("meter_service", "get_meter", {"guid": guid}) for guid in guids
+        )
+        """
+        calls = list(calls)
+        results: list[Any] = [None] * len(calls)
+        timeout = self.timeout if timeout is None else timeout
+        with self as client:
+            reply_listener = (self.leased_client or self).reply_listener
+            in_flight: deque[tuple[list[int], str, Any, float | None]] = deque()
+            next_requests = iter(self.get_fan_out_requests(calls, batch_services))
+            while True:
+                while len(in_flight) < max_concurrency and (request := next(next_requests, None)):
+                    indexes, service_name, method_name, kwargs = request
+                    deadline = None if timeout is None else time.monotonic() + timeout
+                    try:
+                        rpc_call = client[service_name][method_name].call_async(**kwargs)
+                    except Exception as e:
+                        for index in indexes:
+                            results[index] = e
+                        continue
+                    in_flight.append((indexes, method_name, rpc_call, deadline))
+                if not in_flight:
+                    break
+                indexes, method_name, rpc_call, deadline = in_flight.popleft()
+                # a reply received while waiting for the previous ones is returned even if late
+                if deadline is not None:
+                    reply_listener.timeout = max(deadline - time.monotonic(), 0.001)
+                try:
+                    result = rpc_call.result()
+                except Exception as e:
+                    reply_listener.pending.pop(rpc_call.correlation_id, None)
+                    for index in indexes:
+                        results[index] = e
+                    continue
+                if method_name != RPC_BATCH_METHOD:
+                    results[indexes[0]] = result
+                    continue
+                for index, response in zip(indexes, result):
+                    error = response.get("error")
+                    results[index] = deserialize(error) if error else response["result"]
+
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+
+class PooledClusterRpcClient(PoolableClusterRpcClient):
+    """Pooled Cluster Rpc Client.
+
+    Cluster rpc client started by the rpc client pools, keeping its reply connection open.
+    """
 
-class NetworkClusterRpcClient(ClusterRpcClient):
+    reply_listener_cls = PooledReplyListener
+
+
+class NetworkClusterRpcClient(PoolableClusterRpcClient):
     """Network Cluster Rpc Client.
 
     This cluster is used to make call to services in the same network.
-    Using the environment variable RABBITMQ_URI, serializer is pickle by default.
+    Using the environment variable RABBITMQ_URI, serializer is pickle by default (RPC_SERIALIZER
+    environment variable or serializer keyword argument to use myem-msgpack).
     with NetworkClusterRpcClient() as network_rpc:
         guids = network_rpc.customer_center_service.get_user_meters_guid(
             user_id=user_id
         )
+    With pooled=True (RPC_CLIENT_POOLED environment variable by default) a started client is
+    leased from the pool of the broker instead of starting a reply listener. With
+    instrumented=True (RPC_INSTRUMENTATION environment variable by default) the latency, sizes and
+    outcome of the calls are recorded in instrumentation.metrics.
     """
 
     def __init__(
@@ -42,16 +644,17 @@ class NetworkClusterRpcClient(ClusterRpcClient):
         # in order to pass this bug we set by default config["serializer"] to pickle if it's not
         # already set up
         publisher_options["uri"] = os.environ["RABBITMQ_URI"]
-        publisher_options["serializer"] = "pickle"
-        config["serializer"] = config.get("serializer", publisher_options["serializer"])
+        publisher_options.setdefault("serializer", RPC_SERIALIZER)
+        setup_serialization_config(publisher_options["serializer"])
         super().__init__(context_data=context_data, timeout=timeout, **publisher_options)
 
 
-class BackboneClusterRpcClient(ClusterRpcClient):
+class BackboneClusterRpcClient(PoolableClusterRpcClient):
     """Backbone Cluster Rpc Client.
 
     This cluster is used to make call to services in backbone network.
     Using the environment variable BACKBONE_RABBITMQ_URI, serializer is pickle by default
+    (RPC_SERIALIZER environment variable or serializer keyword argument to use myem-msgpack)
     with BackboneClusterRpcClient() as backbone_rpc:
         res = backbone_rpc.commercial_offers.get_contract_periods()
     """
@@ -61,16 +664,17 @@ class BackboneClusterRpcClient(ClusterRpcClient):
     ) -> None:
         """An override of Cluster Rpc Client to add config setup."""
         publisher_options["uri"] = os.environ["BACKBONE_RABBITMQ_URI"]
-        publisher_options["serializer"] = "pickle"
-        config["serializer"] = config.get("serializer", publisher_options["serializer"])
+        publisher_options.setdefault("serializer", RPC_SERIALIZER)
+        setup_serialization_config(publisher_options["serializer"])
         super().__init__(context_data=context_data, timeout=timeout, **publisher_options)
 
 
-class CustomClusterRpcClient(ClusterRpcClient):
+class CustomClusterRpcClient(PoolableClusterRpcClient):
     """Custom Cluster Rpc Client.
 
     This cluster is used to make call to services in the same network.
-    Using variable env rabbitmq_uri, serializer is pickle by default.
+    Using variable env rabbitmq_uri, serializer is pickle by default (RPC_SERIALIZER environment
+    variable or serializer keyword argument to use myem-msgpack).
     with CustomClusterRpcClient(rabbitmq_uri="put_your_rabbitmq_uri_here") as data_rabbitmq_rpc:
         guids = data_rabbitmq_rpc.bl_metrics.get_data(
             user_id=user_id
@@ -82,10 +686,124 @@ class CustomClusterRpcClient(ClusterRpcClient):
         rabbitmq_uri: str,
         context_data: Any = None,
         timeout: int | None = 70,
-        **publisher_options: Any
+        **publisher_options: Any,
     ) -> None:
         """An override of Cluster Rpc Client to add config setup."""
         publisher_options["uri"] = rabbitmq_uri
-        publisher_options["serializer"] = "pickle"
-        config["serializer"] = config.get("serializer", publisher_options["serializer"])
+        publisher_options.setdefault("serializer", RPC_SERIALIZER)
+        setup_serialization_config(publisher_options["serializer"])
         super().__init__(context_data=context_data, timeout=timeout, **publisher_options)
+
+
+class AsyncRpcProxy:
+    """Async Rpc Proxy.
+
+    Attribute access to the services and methods of an AsyncRpcClient, calling a method returns
+    a coroutine.
+    """
+
+    def __init__(
+        self,
+        rpc: "AsyncRpcClient",
+        timeout: float | None = None,
+        service_name: str | None = None,
+        method_name: str | None = None,
+    ) -> None:
+        self.rpc = rpc
+        self.timeout = timeout
+        self.service_name = service_name
+        self.method_name = method_name
+
+    def __getattr__(self, name: str) -> "AsyncRpcProxy":
+        if name.startswith("__") or self.method_name is not None:
+            raise AttributeError(name)
+        if self.service_name is None:
+            return AsyncRpcProxy(self.rpc, self.timeout, name)
+        return AsyncRpcProxy(self.rpc, self.timeout, self.service_name, name)
+
+    async def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        """Call the method."""
+        if self.service_name is None or self.method_name is None:
+            raise Exception(
+                f"Cannot call unspecified method {self.service_name}.{self.method_name} !"
+            )
+        return await self.rpc.call_with_timeout(
+            self.timeout, self.service_name, self.method_name, *args, **kwargs
+        )
+
+
+class AsyncRpcClient:
+    """Async Rpc Client.
+
+    Awaitable facade of cluster rpc clients for asyncio code. Calls run in a thread pool of
+    pool_size threads, each one leasing a started client from the pool of the broker, so the
+    event loop is never blocked and calls don't create a connection and a reply queue.
+    get_network_rpc = NamekoSettingsMixin.get_network_async_rpc
+
+    @app.get("/meters")
+    async def get_meters(rpc: AsyncRpcClient = Depends(get_network_rpc)) -> Any:
+        guids, periods = await asyncio.gather(
+            rpc.customer_center_service.get_user_meters_guid(user_id=user_id),
+            rpc.with_timeout(5).commercial_offers.get_contract_periods(),
+        )
+
+    A timeout, the client timeout by default, bounds the wait for each reply. Cancelling a call
+    that is waiting for its reply doesn't interrupt the wait, its client is released after the
+    reply or the timeout.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[..., PoolableClusterRpcClient],
+        pool_size: int = 10,
+        timeout: float | None = 70,
+        **client_options: Any,
+    ) -> None:
+        self.client_factory = client_factory
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.client_options = client_options
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="async_rpc")
+
+    def __getattr__(self, name: str) -> AsyncRpcProxy:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(AsyncRpcProxy(self), name)
+
+    def with_timeout(self, timeout: float | None) -> AsyncRpcProxy:
+        """Get a proxy of which calls wait for their reply at most timeout seconds."""
+        return AsyncRpcProxy(self, timeout)
+
+    async def call(self, service_name: str, method_name: str, *args: Any, **kwargs: Any) -> Any:
+        """Call a method of a service."""
+        return await self.call_with_timeout(None, service_name, method_name, *args, **kwargs)
+
+    async def call_with_timeout(
+        self, timeout: float | None, service_name: str, method_name: str, *args: Any, **kwargs: Any
+    ) -> Any:
+        """Call a method of a service, waiting for its reply at most timeout seconds."""
+        loop = asyncio.get_running_loop()
+        # the context is copied to the thread for the instrumentation of the request
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self.executor,
+            lambda: context.run(self.call_sync, timeout, service_name, method_name, args, kwargs),
+        )
+
+    def call_sync(
+        self,
+        timeout: float | None,
+        service_name: str,
+        method_name: str,
+        args: tuple[Any, ...],
+        kwargs: dict[str, Any],
+    ) -> Any:
+        """Call a method of a service with a leased client."""
+        timeout = self.timeout if timeout is None else timeout
+        # entered like any client, the pytest fixtures mocking the client classes also mock it
+        with self.client_factory(pooled=True, timeout=timeout, **self.client_options) as client:
+            return client[service_name][method_name](*args, **kwargs)
+
+    def close(self) -> None:
+        """Wait for the running calls."""
+        self.executor.shutdown(wait=True)
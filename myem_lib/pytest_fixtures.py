@@ -1,5 +1,6 @@
 """Builtins Fixtures."""
 import os
+from functools import partial
 from inspect import isfunction
 from random import randint
 from unittest.mock import Mock, MagicMock
@@ -203,57 +204,58 @@ def dummy_func(*args, **kwargs):
     return None
 
 
+def mock_rpc_method(cluster, dict_mock):
+    """Mock a method of a cluster with the mocked response of a dict mock."""
+    method = getattr(getattr(cluster, dict_mock["service_name"]), dict_mock["function_name"])
+    if isinstance(dict_mock["mocked_response"], Exception):
+        method.side_effect = dict_mock["mocked_response"]
+    elif isfunction(dict_mock["mocked_response"]):
+        method.side_effect = dict_mock["mocked_response"]
+    else:
+        method.return_value = dict_mock["mocked_response"]
+    # calls sent with call_async (by fan_out) get the mocked response from their result
+    method.call_async.side_effect = lambda *args, **kwargs: Mock(
+        result=partial(method, *args, **kwargs)
+    )
+
+
+def mock_cluster_rpc_client(monkeypatch, cluster_rpc_client_class, dict_mocks):
+    """Mock the clients of a cluster rpc client class, return the cluster mock they enter."""
+    cluster = MagicMock()
+
+    for dict_mock in dict_mocks:
+        mock_rpc_method(cluster, dict_mock)
+
+    # like nameko clients, services and methods can be accessed with []
+    def get_service(service_name):
+        service = getattr(cluster, service_name)
+        service.__getitem__.side_effect = partial(getattr, service)
+        return service
+
+    cluster.__getitem__.side_effect = get_service
+
+    def __init__(self, *args, **kwargs):
+        # attributes used by fan_out
+        self.timeout = kwargs.get("timeout")
+        self.leased_client = None
+        self.reply_listener = MagicMock()
+
+    def __enter__(*args, **kwargs):
+        return cluster
+
+    monkeypatch.setattr(cluster_rpc_client_class, "__init__", __init__)
+    monkeypatch.setattr(cluster_rpc_client_class, "__enter__", __enter__)
+    monkeypatch.setattr(cluster_rpc_client_class, "__exit__", dummy_func)
+
+    return cluster
+
+
 @pytest.fixture
 def mock_network_nameko_cluster(monkeypatch):
     from myem_lib.nameko_settings_mixins import NetworkClusterRpcClient
-    def set_mock(*args):
-        cluster = MagicMock()
-
-        for dict_mock in args:
-            if isinstance(dict_mock["mocked_response"], Exception):
-                setattr(
-                    getattr(
-                        getattr(cluster, dict_mock["service_name"]),
-                        dict_mock["function_name"],
-                    ),
-                    "side_effect",
-                    dict_mock["mocked_response"],
-                )
-            elif isfunction(dict_mock["mocked_response"]):
-                setattr(
-                    getattr(cluster, dict_mock["service_name"]),
-                    dict_mock["function_name"],
-                    dict_mock["mocked_response"],
-                )
-            else:
-                setattr(
-                    getattr(
-                        getattr(cluster, dict_mock["service_name"]),
-                        dict_mock["function_name"],
-                    ),
-                    "return_value",
-                    dict_mock["mocked_response"],
-                )
-                setattr(
-                    getattr(
-                        getattr(
-                            getattr(cluster, dict_mock["service_name"]),
-                            dict_mock["function_name"],
-                        ),
-                        "call_async",
-                    ),
-                    "return_value",
-                    None,
-                )
-
-        def __enter__(*args, **kwargs):
-            return cluster
-
-        monkeypatch.setattr(NetworkClusterRpcClient, "__init__", dummy_func)
-        monkeypatch.setattr(NetworkClusterRpcClient, "__enter__", __enter__)
-        monkeypatch.setattr(NetworkClusterRpcClient, "__exit__", dummy_func)
 
-        return cluster
+    def set_mock(*args):
+        return mock_cluster_rpc_client(monkeypatch, NetworkClusterRpcClient, args)
 
     yield set_mock
 
@@ -261,54 +263,9 @@ def mock_network_nameko_cluster(monkeypatch):
 @pytest.fixture
 def mock_backbone_nameko_cluster(monkeypatch):
     from myem_lib.nameko_settings_mixins import BackboneClusterRpcClient
-    def set_mock(*args):
-        cluster = MagicMock()
-
-        for dict_mock in args:
-            if isinstance(dict_mock["mocked_response"], Exception):
-                setattr(
-                    getattr(
-                        getattr(cluster, dict_mock["service_name"]),
-                        dict_mock["function_name"],
-                    ),
-                    "side_effect",
-                    dict_mock["mocked_response"],
-                )
-            elif isfunction(dict_mock["mocked_response"]):
-                setattr(
-                    getattr(cluster, dict_mock["service_name"]),
-                    dict_mock["function_name"],
-                    dict_mock["mocked_response"],
-                )
-            else:
-                setattr(
-                    getattr(
-                        getattr(cluster, dict_mock["service_name"]),
-                        dict_mock["function_name"],
-                    ),
-                    "return_value",
-                    dict_mock["mocked_response"],
-                )
-                setattr(
-                    getattr(
-                        getattr(
-                            getattr(cluster, dict_mock["service_name"]),
-                            dict_mock["function_name"],
-                        ),
-                        "call_async",
-                    ),
-                    "return_value",
-                    None,
-                )
-
-        def __enter__(*args, **kwargs):
-            return cluster
-
-        monkeypatch.setattr(BackboneClusterRpcClient, "__init__", dummy_func)
-        monkeypatch.setattr(BackboneClusterRpcClient, "__enter__", __enter__)
-        monkeypatch.setattr(BackboneClusterRpcClient, "__exit__", dummy_func)
 
-        return cluster
+    def set_mock(*args):
+        return mock_cluster_rpc_client(monkeypatch, BackboneClusterRpcClient, args)
 
     yield set_mock
 
@@ -318,52 +275,6 @@ def mock_custom_nameko_cluster(monkeypatch):
     from myem_lib.nameko_settings_mixins import CustomClusterRpcClient
 
     def set_mock(*args):
-        cluster = MagicMock()
-
-        for dict_mock in args:
-            if isinstance(dict_mock["mocked_response"], Exception):
-                setattr(
-                    getattr(
-                        getattr(cluster, dict_mock["service_name"]),
-                        dict_mock["function_name"],
-                    ),
-                    "side_effect",
-                    dict_mock["mocked_response"],
-                )
-            elif isfunction(dict_mock["mocked_response"]):
-                setattr(
-                    getattr(cluster, dict_mock["service_name"]),
-                    dict_mock["function_name"],
-                    dict_mock["mocked_response"],
-                )
-            else:
-                setattr(
-                    getattr(
-                        getattr(cluster, dict_mock["service_name"]),
-                        dict_mock["function_name"],
-                    ),
-                    "return_value",
-                    dict_mock["mocked_response"],
-                )
-                setattr(
-                    getattr(
-                        getattr(
-                            getattr(cluster, dict_mock["service_name"]),
-                            dict_mock["function_name"],
-                        ),
-                        "call_async",
-                    ),
-                    "return_value",
-                    None,
-                )
-
-        def __enter__(*args, **kwargs):
-            return cluster
-
-        monkeypatch.setattr(CustomClusterRpcClient, "__init__", dummy_func)
-        monkeypatch.setattr(CustomClusterRpcClient, "__enter__", __enter__)
-        monkeypatch.setattr(CustomClusterRpcClient, "__exit__", dummy_func)
-
-        return cluster
+        return mock_cluster_rpc_client(monkeypatch, CustomClusterRpcClient, args)
 
     yield set_mock
@@ -0,0 +1,137 @@
+"""Serializers."""
+import struct
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from typing import Any
+from uuid import UUID
+
+from kombu.serialization import register
+
+
+try:
+    # msgpack is an optional dependency, only needed by services using this serializer, imported
+    # once as the default and ext hook functions are called for every object they handle
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_SERIALIZER = "myem-msgpack"
+MSGPACK_CONTENT_TYPE = "application/x-myem-msgpack"
+
+# serializers accepted by consumers and rpc reply listeners, a rolling deploy can then mix
+# services sending pickle and msgpack, messages are decoded depending on their content type.
+ACCEPTED_SERIALIZERS = ["pickle", MSGPACK_SERIALIZER]
+
+# nameko SERIALIZERS config registering the msgpack serializer in nameko services
+SERIALIZERS_CONFIG = {
+    MSGPACK_SERIALIZER: {
+        "encoder": "myem_lib.serializers.msgpack_dumps",
+        "decoder": "myem_lib.serializers.msgpack_loads",
+        "content_type": MSGPACK_CONTENT_TYPE,
+        "content_encoding": "binary",
+    }
+}
+
+# msgpack extension type codes, timezone aware datetimes are packed as msgpack timestamps
+NAIVE_DATETIME_EXT = 1
+DATE_EXT = 2
+TIME_EXT = 3
+UUID_EXT = 4
+DECIMAL_EXT = 5
+
+# fields of naive datetimes and dates, microseconds are omitted when 0
+DATETIME_STRUCT = struct.Struct(">HBBBBB")
+DATETIME_MICROSECOND_STRUCT = struct.Struct(">HBBBBBI")
+DATE_STRUCT = struct.Struct(">HBB")
+
+
+def pack_naive_datetime(obj: datetime) -> bytes:
+    """Pack the fields of a naive datetime."""
+    if obj.microsecond:
+        return DATETIME_MICROSECOND_STRUCT.pack(
+            obj.year, obj.month, obj.day, obj.hour, obj.minute, obj.second, obj.microsecond
+        )
+    return DATETIME_STRUCT.pack(obj.year, obj.month, obj.day, obj.hour, obj.minute, obj.second)
+
+
+def unpack_naive_datetime(data: bytes) -> datetime:
+    """Unpack the fields of a naive datetime."""
+    if len(data) == DATETIME_STRUCT.size:
+        return datetime(*DATETIME_STRUCT.unpack(data))
+    return datetime(*DATETIME_MICROSECOND_STRUCT.unpack(data))
+
+
+EXT_ENCODERS: dict[type, Any] = {
+    datetime: lambda obj: (NAIVE_DATETIME_EXT, pack_naive_datetime(obj)),
+    date: lambda obj: (DATE_EXT, DATE_STRUCT.pack(obj.year, obj.month, obj.day)),
+    time: lambda obj: (TIME_EXT, obj.isoformat().encode()),
+    UUID: lambda obj: (UUID_EXT, obj.bytes),
+    Decimal: lambda obj: (DECIMAL_EXT, str(obj).encode()),
+}
+
+EXT_DECODERS: dict[int, Any] = {
+    NAIVE_DATETIME_EXT: unpack_naive_datetime,
+    DATE_EXT: lambda data: date(*DATE_STRUCT.unpack(data)),
+    TIME_EXT: lambda data: time.fromisoformat(data.decode()),
+    UUID_EXT: lambda data: UUID(bytes=data),
+    DECIMAL_EXT: lambda data: Decimal(data.decode()),
+}
+
+
+def msgpack_default(obj: Any) -> Any:
+    """Encode the types not handled natively by msgpack, called for each of their objects."""
+    # naive datetimes are by far the most common objects here, checked first
+    if type(obj) is datetime:  # pylint: disable=unidiomatic-typecheck
+        return msgpack.ExtType(NAIVE_DATETIME_EXT, pack_naive_datetime(obj))
+    if encode := EXT_ENCODERS.get(type(obj)):
+        return msgpack.ExtType(*encode(obj))
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    for ext_type, encode in EXT_ENCODERS.items():
+        if isinstance(obj, ext_type):
+            return msgpack.ExtType(*encode(obj))
+    raise TypeError(f"Object of type {type(obj).__name__} is not msgpack serializable")
+
+
+def msgpack_ext_hook(code: int, data: bytes) -> Any:
+    """Decode the extension types of msgpack_default."""
+    if code == NAIVE_DATETIME_EXT:
+        return unpack_naive_datetime(data)
+    if decode := EXT_DECODERS.get(code):
+        return decode(data)
+    return msgpack.ExtType(code, data)
+
+
+def msgpack_dumps(obj: Any) -> bytes:
+    """Serialize an object with msgpack.
+
+    Tuples, sets and frozensets are packed as arrays and decoded as lists, like with JSON.
+    """
+    if msgpack is None:
+        raise Exception("msgpack is not installed, install myem_lib[msgpack] !")
+    return msgpack.packb(obj, default=msgpack_default, datetime=True)
+
+
+def msgpack_loads(data: bytes) -> Any:
+    """Deserialize an object serialized with msgpack_dumps."""
+    if msgpack is None:
+        raise Exception("msgpack is not installed, install myem_lib[msgpack] !")
+    # msgpack timestamps are decoded as timezone aware UTC datetimes
+    return msgpack.unpackb(data, ext_hook=msgpack_ext_hook, strict_map_key=False, timestamp=3)
+
+
+def register_serializers() -> None:
+    """Register the msgpack serializer in kombu."""
+    register(
+        MSGPACK_SERIALIZER,
+        msgpack_dumps,
+        msgpack_loads,
+        content_type=MSGPACK_CONTENT_TYPE,
+        content_encoding="binary",
+    )
+
+
+register_serializers()
@@ -1,9 +1,39 @@
 """Sync handler."""
+import atexit
 import logging
+import operator
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from datetime import datetime, timedelta
+from functools import partial
 from typing import Any, Literal, TypedDict
 
-from kombu import Connection, Exchange, Producer
+import eventlet
+from kombu import Connection, Exchange
+from kombu.pools import ProducerPool
+from nameko.exceptions import ContainerBeingKilled
+from nameko.extensions import DependencyProvider
+from nameko.messaging import Consumer, decode_from_headers
 from nameko_sqlalchemy import DatabaseSession
+from sqlalchemy import (
+    bindparam,
+    Column,
+    DateTime,
+    delete,
+    inspect,
+    MetaData,
+    select,
+    String,
+    Table,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from myem_lib.caches import TtlLruCache
+from myem_lib.serializers import ACCEPTED_SERIALIZERS
 
 
 class RowToSyncType(TypedDict):
@@ -14,11 +44,349 @@ class RowToSyncType(TypedDict):
     columns_to_sync: dict[str, Any] | None
 
 
+class SyncModelMetadata(TypedDict):
+    """Sync Model Metadata.
+
+    Column metadata of a model to sync, computed once when the consumer class is defined.
+    """
+
+    model: Any
+    columns: dict[str, Any]
+    column_types: dict[str, Any]
+    primary_keys: tuple[str, ...]
+
+
+def get_sync_model_metadata(model: Any) -> SyncModelMetadata:
+    """Compute the sync metadata of a model."""
+    mapper = inspect(model)
+    return {
+        "model": model,
+        "columns": {prop.key: getattr(model, prop.key) for prop in mapper.column_attrs},
+        "column_types": {prop.key: prop.columns[0].type for prop in mapper.column_attrs},
+        "primary_keys": tuple(
+            mapper.get_property_by_column(column).key for column in mapper.primary_key
+        ),
+    }
+
+
+SQL_OPERATORS: dict[str, Callable[[Any, Any], Any]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "in_": lambda column, value: column.in_(value),
+    "notin_": lambda column, value: column.notin_(value),
+    "is_": lambda column, value: column.is_(value),
+    "not_": lambda column, value: column.is_not(value),
+    ">=": operator.ge,
+    ">": operator.gt,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+# operators taking a list of values, bound with an expanding parameter
+EXPANDING_OPERATORS = {"in_", "notin_"}
+# operators compared to None, True or False, the value is part of the statement shape
+LITERAL_OPERATORS = {"is_", "not_"}
+# "==" and "!=" None are compiled to IS NULL and IS NOT NULL, like SQL_OPERATORS does
+NULL_OPERATORS = {"==": "is_", "!=": "not_"}
+
+
+def is_literal_identifier(op: str, value: Any) -> bool:
+    """Whether the value of an identifier is part of the statement shape instead of a param."""
+    return op in LITERAL_OPERATORS or (op in NULL_OPERATORS and value is None)
+
+
+class SyncStatementCompiler:
+    """Sync Statement Compiler.
+
+    Turns the shape of a row to sync (model, op, (column, operator) sequence and columns to sync)
+    into a reusable DELETE or UPDATE statement with bound parameters. Compiled statements are kept
+    in a LRU cache of maxsize entries, so only the parameters change between rows of the same
+    shape. Unknown columns and operators are rejected when compiling.
+    """
+
+    def __init__(self, maxsize: int = 512) -> None:
+        self.statements = TtlLruCache(maxsize)
+
+    @staticmethod
+    def get_shape(model: Any, row_to_sync: RowToSyncType) -> tuple[Any, ...]:
+        """Get the shape of a row to sync, used as cache key."""
+        return (
+            model,
+            row_to_sync["op"],
+            tuple(
+                (column, op, value) if is_literal_identifier(op, value) else (column, op)
+                for column, op, value in row_to_sync["identifiers"]
+            ),
+            tuple(row_to_sync.get("columns_to_sync") or ()),
+        )
+
+    @staticmethod
+    def get_params(row_to_sync: RowToSyncType) -> dict[str, Any]:
+        """Get the bound parameters of a row to sync."""
+        params = {
+            f"sync_identifier_{index}": value
+            for index, (_, op, value) in enumerate(row_to_sync["identifiers"])
+            if not is_literal_identifier(op, value)
+        }
+        for column, value in (row_to_sync.get("columns_to_sync") or {}).items():
+            params[f"sync_value_{column}"] = value
+        return params
+
+    def compile(
+        self, model_metadata: SyncModelMetadata, row_to_sync: RowToSyncType
+    ) -> tuple[Any, dict[str, Any]]:
+        """Return the statement and the bound parameters of a row to sync."""
+        shape = self.get_shape(model_metadata["model"], row_to_sync)
+        if (statement := self.statements.get(shape)) is None:
+            statement = self.compile_shape(shape, model_metadata)
+            self.statements.set(shape, statement)
+        return statement, self.get_params(row_to_sync)
+
+    @staticmethod
+    def get_column(model_metadata: SyncModelMetadata, column: str) -> Any:
+        """Get a model column, raise an exception if it doesn't exist."""
+        if (model_column := model_metadata["columns"].get(column)) is None:
+            raise Exception(
+                f"column {column} doesn't exist in table {model_metadata['model'].__tablename__} !"
+            )
+        return model_column
+
+    def compile_shape(self, shape: tuple[Any, ...], model_metadata: SyncModelMetadata) -> Any:
+        """Compile a statement from a row shape."""
+        model, op, identifiers, columns_to_sync = shape
+        _filter = []
+        for index, identifier in enumerate(identifiers):
+            column, sql_op = identifier[0], identifier[1]
+            if len(identifier) == 3 and sql_op in NULL_OPERATORS:
+                sql_op = NULL_OPERATORS[sql_op]
+            if not (sql_operator := SQL_OPERATORS.get(sql_op)):
+                raise Exception("Unkown operator consider handle this one !")
+            if sql_op in LITERAL_OPERATORS:
+                value = identifier[2]
+            else:
+                value = bindparam(
+                    f"sync_identifier_{index}", expanding=sql_op in EXPANDING_OPERATORS
+                )
+            _filter.append(sql_operator(self.get_column(model_metadata, column), value))
+
+        if op == "DELETE":
+            statement = delete(model).where(*_filter)
+        elif op == "UPDATE":
+            for column in columns_to_sync:
+                self.get_column(model_metadata, column)
+            statement = (
+                update(model)
+                .where(*_filter)
+                .values(
+                    {
+                        column: bindparam(
+                            f"sync_value_{column}", type_=model_metadata["column_types"][column]
+                        )
+                        for column in columns_to_sync
+                    }
+                )
+            )
+        else:
+            raise Exception(f"Invalid operation {op} !")
+        return statement.execution_options(synchronize_session=False)
+
+
+def merge_rows_to_sync(rows_to_sync: list[RowToSyncType]) -> list[RowToSyncType]:
+    """Merge consecutive compatible rows into set-based rows.
+
+    Consecutive rows with the same op, the same columns_to_sync and a single "==" or "in_"
+    identifier on the same column are merged into one "in_" identifier, so many DELETEs
+    (or UPDATEs to the same values) end up in one statement. Consecutive identical rows and
+    duplicated values are dropped. Only consecutive rows are merged to keep the order of
+    operations of the message. "==" None rows are not merged, IN (NULL) would match nothing.
+    """
+    merged: list[RowToSyncType] = []
+    previous_key = None
+    merged_values: dict[Any, None] = {}
+    for row_to_sync in rows_to_sync:
+        identifiers = row_to_sync["identifiers"]
+        if (
+            len(identifiers) != 1
+            or identifiers[0][1] not in ("==", "in_")
+            or (identifiers[0][1] == "==" and identifiers[0][2] is None)
+        ):
+            if not merged or row_to_sync != merged[-1]:
+                merged.append(row_to_sync)
+            previous_key = None
+            continue
+        column, op, value = identifiers[0]
+        values = list(value) if op == "in_" else [value]
+        if (key := (row_to_sync["op"], column, row_to_sync.get("columns_to_sync"))) == previous_key:
+            for value in values:
+                if value not in merged_values:
+                    merged_values[value] = None
+                    merged[-1]["identifiers"][0][2].append(value)
+            continue
+        merged_values = dict.fromkeys(values)
+        merged.append(
+            {
+                "identifiers": [[column, "in_", list(merged_values)]],
+                "op": row_to_sync["op"],
+                "columns_to_sync": row_to_sync.get("columns_to_sync"),
+            }
+        )
+        previous_key = key
+    return merged
+
+
+# headers stamped by DbSyncPublisher on every sync message
+SYNC_MESSAGE_ID_HEADER = "sync_message_id"
+# context data key of the message ids of a batch handled by BatchConsumer
+SYNC_MESSAGE_IDS_CONTEXT_KEY = "sync_message_ids"
+
+sync_messages_table = Table(
+    "sync_messages",
+    MetaData(),
+    Column("message_id", String, primary_key=True),
+    Column("created_at", DateTime, default=datetime.now, nullable=False, index=True),
+)
+
+
+class SyncDeduplicationStore:
+    """Sync Deduplication Store.
+
+    In memory LRU of the synced message ids, of at most maxsize ids expiring after ttl seconds.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 3600) -> None:
+        self.message_ids = TtlLruCache(maxsize, ttl)
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self.message_ids
+
+    def add(self, message_id: str) -> None:
+        """Add a synced message id."""
+        self.message_ids.set(message_id, True)
+
+
+class SyncMessageIds(DependencyProvider):
+    """Sync Message Ids.
+
+    Provides the ids stamped by DbSyncPublisher of the messages handled by a worker.
+    """
+
+    def get_dependency(self, worker_ctx: Any) -> list[str | None]:
+        """Get the message ids from the worker context data."""
+        if SYNC_MESSAGE_IDS_CONTEXT_KEY in worker_ctx.context_data:
+            return list(worker_ctx.context_data[SYNC_MESSAGE_IDS_CONTEXT_KEY])
+        return [worker_ctx.context_data.get(SYNC_MESSAGE_ID_HEADER)]
+
+
+class BatchConsumer(Consumer):
+    """Batch Consumer.
+
+    Decorates a method as a consumer of batches of messages, the method receives the list of the
+    message bodies. A batch is handled when batch_size messages are received or batch_timeout
+    milliseconds after its first message, prefetch_count defaults to batch_size. Messages of a
+    batch are acknowledged together when the method returns. If it raises, each message of the
+    batch is handled again on its own to isolate the failing one.
+    """
+
+    def __init__(
+        self,
+        queue: Any,
+        batch_size: int = 100,
+        batch_timeout: int = 200,
+        requeue_on_error: bool = False,
+        **consumer_options: Any,
+    ) -> None:
+        consumer_options.setdefault("prefetch_count", batch_size)
+        consumer_options.setdefault("accept", ACCEPTED_SERIALIZERS)
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.batch: list[tuple[Any, Any]] = []
+        self.batch_number = 0
+        super().__init__(queue, requeue_on_error=requeue_on_error, **consumer_options)
+
+    def handle_message(self, body: Any, message: Any) -> None:
+        """Add a message to the current batch."""
+        self.batch.append((body, message))
+        if len(self.batch) >= self.batch_size:
+            self.flush_batch()
+        elif len(self.batch) == 1:
+            self.container.spawn_managed_thread(
+                partial(self.flush_batch_after_timeout, self.batch_number),
+                identifier=f"{type(self).__name__}.flush_batch[{self.method_name}]",
+            )
+
+    def flush_batch_after_timeout(self, batch_number: int) -> None:
+        """Handle the batch batch_timeout milliseconds after its first message."""
+        eventlet.sleep(self.batch_timeout / 1000)
+        if self.batch_number == batch_number:
+            self.flush_batch()
+
+    def flush_batch(self) -> None:
+        """Handle the current batch."""
+        batch, self.batch = self.batch, []
+        self.batch_number += 1
+        if batch:
+            self.spawn_batch_worker(batch, retry_individually=len(batch) > 1)
+
+    def spawn_batch_worker(self, batch: list[tuple[Any, Any]], retry_individually: bool) -> None:
+        """Spawn a worker handling a batch of messages."""
+        args = ([body for body, _ in batch],)
+        context_data = decode_from_headers(batch[0][1].headers)
+        context_data[SYNC_MESSAGE_IDS_CONTEXT_KEY] = [
+            message.headers.get(SYNC_MESSAGE_ID_HEADER) for _, message in batch
+        ]
+        handle_result = partial(self.handle_batch_result, batch, retry_individually)
+
+        def spawn_worker() -> None:
+            try:
+                self.container.spawn_worker(
+                    self, args, {}, context_data=context_data, handle_result=handle_result
+                )
+            except ContainerBeingKilled:
+                for _, message in batch:
+                    self.consumer.requeue_message(message)
+
+        # like Consumer.handle_message, spawn a thread to avoid blocking the amqp consumer
+        # when the worker pool is exhausted
+        self.container.spawn_managed_thread(
+            spawn_worker,
+            identifier=f"{type(self).__name__}.wait_for_worker_pool[{self.method_name}]",
+        )
+
+    def handle_batch_result(
+        self,
+        batch: list[tuple[Any, Any]],
+        retry_individually: bool,
+        worker_ctx: Any,
+        result: Any = None,
+        exc_info: Any = None,
+    ) -> tuple[Any, Any]:
+        """Acknowledge the messages of a batch, or retry them one by one if it failed."""
+        if exc_info is not None and retry_individually:
+            logging.warning(f"batch of {len(batch)} messages failed, retrying them one by one")
+            for item in batch:
+                self.spawn_batch_worker([item], retry_individually=False)
+        else:
+            for _, message in batch:
+                self.handle_message_processed(message, result, exc_info)
+        return result, exc_info
+
+
+consume_batch = BatchConsumer.decorator
+
+
 class DbSyncConsumer:
     """Db Consumer.
 
+    Models are registered by table name (and schema.table) when the class is defined, use
+    table_aliases to sync several models from one incoming table name.
+    Set sync_in_transaction to True to apply a whole message in one transaction (with an optional
+    commit_batch_size), consecutive compatible rows are then merged into set-based statements.
+    Use consume_batch instead of consume with sync_db_models to apply several messages at once.
+    Set chunk_size to apply DELETE and UPDATE statements in primary key chunks committed one by
+    one, a message is then no longer applied atomically but can be replayed safely.
+
     Usage
     you have to inherit this class in the service you want to use.
+
     Example
     class NrlinkMetricsService(DbSyncConsumer):
         name = "backbone_metrics_nrlink_service"
@@ -33,17 +401,90 @@ class DbSyncConsumer:
         )
         def consume_messages(self, body: dict[str, Any]) -> None:
             self.sync_db_model(body)
+
     """
 
     models: Any = []
     db: DatabaseSession
     name: str
 
+    # incoming table names mapped to other registered table names, to sync several models
+    # (or a schema qualified one) from one table name.
+    table_aliases: dict[str, list[str]] = {}
+    # table name (and schema.table for models having a schema) mapped to the models metadata,
+    # built once when the consumer class is defined.
+    model_registry: dict[str, list[SyncModelMetadata]] = {}
+
+    # when enabled a whole message is applied in a single transaction, instead of committing
+    # after every row. commit_batch_size allows to commit every n statements for huge messages.
+    sync_in_transaction: bool = False
+    commit_batch_size: int | None = None
+    statement_compiler = SyncStatementCompiler()
+    # when set, statements are applied on chunk_size rows at a time ordered by primary key and
+    # committed after each chunk, sleeping chunk_pause seconds to let other greenthreads
+    # (consumers, heartbeats) run. Statements are idempotent so a redelivered message resumes the
+    # work where it stopped.
+    chunk_size: int | None = None
+    chunk_pause: float = 0
+    # when set with sync_in_transaction, the tables of a message are synced concurrently by at most
+    # max_table_concurrency greenthreads, each one with its own session from the db engine pool
+    # (psycopg2 has to be patched by psycogreen to run statements concurrently). With
+    # table_failure_mode "all" every table is rolled back when one fails, with "best_effort" the
+    # tables which succeeded are committed and the failures are logged. "all" is not atomic: the
+    # tables are committed one after another once all of them succeeded, when a commit fails the
+    # tables committed before it stay committed. It can't be used with commit_batch_size or
+    # chunk_size, which commit inside each table.
+    max_table_concurrency: int | None = None
+    table_failure_mode: Literal["all", "best_effort"] = "all"
+    # messages already synced (redelivered or published twice) are skipped, using the message
+    # id stamped by DbSyncPublisher. With persist_message_ids the ids are also stored in the
+    # sync_messages table once all the rows of the message are synced: in the same transaction as
+    # the rows in sync_in_transaction mode, in their own transaction after the per table commits
+    # of max_table_concurrency and after the per row commits otherwise. Ids older than
+    # sync_messages_ttl seconds are deleted every sync_messages_purge_interval seconds.
+    sync_message_ids: Any = SyncMessageIds()
+    deduplication_store: SyncDeduplicationStore | None = SyncDeduplicationStore()
+    persist_message_ids: bool = False
+    sync_messages_ttl: float = 3600
+    sync_messages_purge_interval: float = 60
+    sync_messages_table_created: bool = False
+    sync_messages_purged_at: float = 0
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        """Build the model registry of the consumer class."""
+        super().__init_subclass__(**kwargs)
+        cls.model_registry = cls.build_model_registry()
+
+    @classmethod
+    def build_model_registry(cls) -> dict[str, list[SyncModelMetadata]]:
+        """Build the model registry from models and table_aliases."""
+        model_registry: dict[str, list[SyncModelMetadata]] = {}
+        for model in cls.models:
+            model_metadata = get_sync_model_metadata(model)
+            model_registry.setdefault(model.__tablename__, []).append(model_metadata)
+            if schema := model.__table__.schema:
+                model_registry.setdefault(f"{schema}.{model.__tablename__}", []).append(
+                    model_metadata
+                )
+        for table_name, aliased_table_names in cls.table_aliases.items():
+            aliased_models_metadata: list[SyncModelMetadata] = []
+            for aliased_table_name in aliased_table_names:
+                for model_metadata in model_registry.get(aliased_table_name, []):
+                    if all(model_metadata is not other for other in aliased_models_metadata):
+                        aliased_models_metadata.append(model_metadata)
+            model_registry[table_name] = aliased_models_metadata
+        return model_registry
+
+    def get_models_metadata(self, table_name: str) -> list[SyncModelMetadata]:
+        """Get the metadata of the models registered for a table name."""
+        if not (models_metadata := self.model_registry.get(table_name)):
+            raise Exception(f"table {table_name} doesn't exist !")
+        return models_metadata
+
     def get_model(self, table_name: str) -> Any | None:
         """Get model from table name if existed."""
-        for model in self.models:
-            if model.__tablename__ == table_name:
-                return model
+        if models_metadata := self.model_registry.get(table_name):
+            return models_metadata[0]["model"]
         return None
 
     @staticmethod
@@ -52,48 +493,285 @@ class DbSyncConsumer:
         _filter = []
         for filer_row in identifiers:
             column, op, value = filer_row
-            if op == "==":
-                _filter.append(getattr(model, column) == value)
-            elif op == "!=":
-                _filter.append(getattr(model, column) != value)
-            elif op == "in_":
-                _filter.append(getattr(model, column).in_(value))
-            elif op == "notin_":
-                _filter.append(getattr(model, column).notin_(value))
-            elif op == "is_":
-                _filter.append(getattr(model, column).is_(value))
-            elif op == "not_":
-                _filter.append(getattr(model, column).not_(value))
-            elif op == ">=":
-                _filter.append(getattr(model, column) >= value)
-            elif op == ">":
-                _filter.append(getattr(model, column) > value)
-            elif op == "<":
-                _filter.append(getattr(model, column) < value)
-            elif op == "<=":
-                _filter.append(getattr(model, column) <= value)
-            else:
+            if not (sql_operator := SQL_OPERATORS.get(op)):
                 raise Exception("Unkown operator consider handle this one !")
+            _filter.append(sql_operator(getattr(model, column), value))
         return _filter
 
-    def sync_db_model(self, body: dict[str, Any]) -> None:
-        """Sync db models."""
+    merge_rows_to_sync = staticmethod(merge_rows_to_sync)
+
+    def sync_db_model(self, body: dict[str, Any], message_id: str | None = None) -> dict[str, int]:
+        """Sync db models.
+
+        Returns the number of rows affected per table.
+        """
         logging.info("db sync request has arrived !")
+        message_ids: list[str | None] = [message_id] if message_id else self.get_sync_message_ids()
+        if self.filter_synced_messages(message_ids) != message_ids:
+            logging.info(f"db sync request {message_ids[0]} already synced, skipping it !")
+            return {}
+        if not self.sync_in_transaction:
+            rows_affected = self._sync_db_model_per_row(body, message_ids)
+        else:
+            rows_affected = self._sync_db_model_in_transaction(body, message_ids)
+        self.add_synced_messages(message_ids)
+        return rows_affected
+
+    def sync_db_models(
+        self, bodies: list[dict[str, Any]], message_ids: list[str | None] | None = None
+    ) -> dict[str, int]:
+        """Sync db models of a batch of messages in one transaction.
+
+        Rows of the same table are concatenated in the order of the messages, then merged like
+        in sync_in_transaction mode. Returns the number of rows affected per table.
+        """
+        logging.info(f"db sync batch of {len(bodies)} requests has arrived !")
+        message_ids = message_ids or self.get_sync_message_ids()
+        if len(message_ids) == len(bodies):
+            not_synced_message_ids = self.filter_synced_messages(message_ids)
+            bodies = [
+                message_body
+                for message_body, message_id in zip(bodies, message_ids)
+                if message_id in not_synced_message_ids
+            ]
+            message_ids = not_synced_message_ids
+        body: dict[str, list[RowToSyncType]] = {}
+        for message_body in bodies:
+            for table_name, rows_to_sync in message_body.items():
+                body.setdefault(table_name, []).extend(rows_to_sync)
+        rows_affected = self._sync_db_model_in_transaction(body, message_ids)
+        self.add_synced_messages(message_ids)
+        return rows_affected
+
+    def get_sync_message_ids(self) -> list[str | None]:
+        """Get the ids of the messages handled by the worker, empty outside of a worker."""
+        return self.sync_message_ids if isinstance(self.sync_message_ids, list) else []
+
+    def filter_synced_messages(self, message_ids: list[str | None]) -> list[str | None]:
+        """Remove the ids of the messages already synced."""
+        if self.deduplication_store is not None:
+            message_ids = [
+                message_id
+                for message_id in message_ids
+                if message_id is None or message_id not in self.deduplication_store
+            ]
+        if self.persist_message_ids and any(message_ids):
+            self.create_sync_messages_table()
+            synced_message_ids = set(
+                self.db.execute(
+                    select(sync_messages_table.c.message_id).where(
+                        sync_messages_table.c.message_id.in_([_id for _id in message_ids if _id])
+                    )
+                ).scalars()
+            )
+            message_ids = [_id for _id in message_ids if _id not in synced_message_ids]
+        return message_ids
+
+    def add_synced_messages(self, message_ids: list[str | None]) -> None:
+        """Add synced message ids to the deduplication store."""
+        if self.deduplication_store is not None:
+            for message_id in message_ids:
+                if message_id:
+                    self.deduplication_store.add(message_id)
+
+    def persist_synced_messages(self, message_ids: list[str | None]) -> None:
+        """Insert synced message ids in the sync_messages table, in the current transaction.
+
+        Raises an exception if one of them was synced meanwhile by another worker.
+        """
+        if not self.persist_message_ids or not (message_ids := [_id for _id in message_ids if _id]):
+            return
+        result = self.db.execute(
+            insert(sync_messages_table)
+            .values([{"message_id": message_id} for message_id in message_ids])
+            .on_conflict_do_nothing()
+        )
+        if result.rowcount != len(message_ids):
+            raise Exception(f"db sync requests {message_ids} already synced !")
+        self.purge_synced_messages()
+
+    def purge_synced_messages(self) -> None:
+        """Delete the ids older than sync_messages_ttl, at most every purge interval."""
+        if time.monotonic() - self.sync_messages_purged_at < self.sync_messages_purge_interval:
+            return
+        type(self).sync_messages_purged_at = time.monotonic()
+        self.db.execute(
+            delete(sync_messages_table).where(
+                sync_messages_table.c.created_at
+                < datetime.now() - timedelta(seconds=self.sync_messages_ttl)
+            )
+        )
+
+    def create_sync_messages_table(self) -> None:
+        """Create the sync_messages table if it doesn't exist."""
+        if not self.sync_messages_table_created:
+            sync_messages_table.create(self.db.get_bind(), checkfirst=True)
+            type(self).sync_messages_table_created = True
+
+    def _sync_db_model_in_transaction(
+        self, body: dict[str, Any], message_ids: list[str | None] | None = None
+    ) -> dict[str, int]:
+        """Sync db models in one transaction, committing every commit_batch_size statements."""
+        if self.max_table_concurrency and len(body) > 1:
+            return self._sync_db_model_concurrently(
+                body, self.max_table_concurrency, message_ids or []
+            )
+        rows_affected: dict[str, int] = {}
+        try:
+            for table_name, rows_to_sync in body.items():
+                rows_affected[table_name] = self._sync_table(self.db, table_name, rows_to_sync)
+            # inserted last, commit_batch_size and chunk_size commits must not mark the message
+            # as synced before all its rows are
+            self.persist_synced_messages(message_ids or [])
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        logging.info(f"db sync request done, rows affected {rows_affected}")
+        return rows_affected
+
+    def _sync_db_model_concurrently(
+        self, body: dict[str, Any], max_table_concurrency: int, message_ids: list[str | None]
+    ) -> dict[str, int]:
+        """Sync the tables of a message concurrently, each one with its own session."""
+        if self.table_failure_mode == "all" and (self.commit_batch_size or self.chunk_size):
+            raise Exception(
+                'table_failure_mode "all" can\'t roll back tables committed by commit_batch_size'
+                " or chunk_size !"
+            )
+        engine = self.db.get_bind()
+        sessions = {table_name: Session(bind=engine) for table_name in body}
+        results: dict[str, int | Exception] = {}
+
+        def sync_table(table_name: str) -> None:
+            try:
+                results[table_name] = self._sync_table(
+                    sessions[table_name], table_name, body[table_name]
+                )
+            except Exception as e:
+                logging.error(f"could not sync table {table_name} {e}")
+                results[table_name] = e
+
+        try:
+            pool = eventlet.GreenPool(max_table_concurrency)
+            for table_name in body:
+                pool.spawn_n(sync_table, table_name)
+            pool.waitall()
+            errors = [error for error in results.values() if isinstance(error, Exception)]
+            # a failed commit stops here, the sessions not committed yet are rolled back on close
+            for table_name, session in sessions.items():
+                if isinstance(results[table_name], Exception) or (
+                    errors and self.table_failure_mode == "all"
+                ):
+                    session.rollback()
+                else:
+                    session.commit()
+            if not errors or self.table_failure_mode == "best_effort":
+                self.persist_synced_messages(message_ids)
+                self.db.commit()
+        finally:
+            for session in sessions.values():
+                session.close()
+        if errors and self.table_failure_mode == "all":
+            raise errors[0]
+        rows_affected = {
+            table_name: result for table_name, result in results.items() if isinstance(result, int)
+        }
+        logging.info(f"db sync request done, rows affected {rows_affected}")
+        return rows_affected
+
+    def _sync_table(self, db: Any, table_name: str, rows_to_sync: list[RowToSyncType]) -> int:
+        """Sync the merged rows of a table, committing every commit_batch_size statements."""
+        models_metadata = self.get_models_metadata(table_name)
+        logging.info(f"syncing table {table_name}")
+        rows_affected = 0
+        pending_statements = 0
+        for row_to_sync in self.merge_rows_to_sync(rows_to_sync):
+            for model_metadata in models_metadata:
+                rows_affected += self._execute_row_to_sync(model_metadata, row_to_sync, db)
+                pending_statements += 1
+            if self.commit_batch_size and pending_statements >= self.commit_batch_size:
+                db.commit()
+                pending_statements = 0
+        return rows_affected
+
+    def _sync_db_model_per_row(
+        self, body: dict[str, Any], message_ids: list[str | None] | None = None
+    ) -> dict[str, int]:
+        """Sync db models committing after every row."""
+        rows_affected: dict[str, int] = {}
         for table_name, rows_to_sync in body.items():
-            if not (model := (self.get_model(table_name))):
-                raise Exception(f"table {table_name} doesn't exist !")
+            models_metadata = self.get_models_metadata(table_name)
             logging.info(f"syncing table {table_name}")
+            rows_affected[table_name] = 0
             for row_to_sync in rows_to_sync:
-                _filter = self.format_sql_filter(model, row_to_sync["identifiers"])
-                query = self.db.query(model).filter(*_filter)
-                if row_to_sync["op"] == "DELETE":
-                    query.delete()
+                for model_metadata in models_metadata:
+                    rows_affected[table_name] += self._execute_row_to_sync(
+                        model_metadata, row_to_sync
+                    )
                     self.db.commit()
-                elif row_to_sync["op"] == "UPDATE":
-                    query.update(row_to_sync["columns_to_sync"])
-                    self.db.commit()
-                else:
-                    raise Exception(f"Invalid operation {row_to_sync['op']} !")
+        if self.persist_message_ids:
+            try:
+                self.persist_synced_messages(message_ids or [])
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+        return rows_affected
+
+    def _execute_row_to_sync(
+        self, model_metadata: SyncModelMetadata, row_to_sync: RowToSyncType, db: Any = None
+    ) -> int:
+        """Execute the statement of a row to sync and return the number of rows affected."""
+        db = self.db if db is None else db
+        statement, params = self.statement_compiler.compile(model_metadata, row_to_sync)
+        if self.chunk_size:
+            return self._execute_statement_in_chunks(
+                db, model_metadata, statement, params, self.chunk_size
+            )
+        return db.execute(statement, params).rowcount
+
+    def _execute_statement_in_chunks(
+        self,
+        db: Any,
+        model_metadata: SyncModelMetadata,
+        statement: Any,
+        params: dict[str, Any],
+        chunk_size: int,
+    ) -> int:
+        """Execute a statement by chunks of primary keys, committing after each chunk."""
+        primary_keys = [model_metadata["columns"][key] for key in model_metadata["primary_keys"]]
+        primary_key = tuple_(*primary_keys) if len(primary_keys) > 1 else primary_keys[0]
+        chunk_query = select(*primary_keys).order_by(*primary_keys).limit(chunk_size)
+        # rows without identifiers have no where clause and affect the whole table
+        if statement.whereclause is not None:
+            chunk_query = chunk_query.where(statement.whereclause)
+        rows_affected = 0
+        last_key = None
+        while True:
+            query = chunk_query
+            if last_key is not None:
+                query = query.where(
+                    primary_key > (tuple_(*last_key) if len(primary_keys) > 1 else last_key[0])
+                )
+            if not (keys := db.execute(query, params).all()):
+                break
+            chunk_keys = [tuple(key) if len(primary_keys) > 1 else key[0] for key in keys]
+            rows_affected += db.execute(
+                statement.where(primary_key.in_(chunk_keys)), params
+            ).rowcount
+            db.commit()
+            self.on_sync_progress(model_metadata["model"].__tablename__, rows_affected)
+            if len(keys) < chunk_size:
+                break
+            last_key = keys[-1]
+            # time.sleep is patched by eventlet in nameko services and yields to other greenthreads
+            time.sleep(self.chunk_pause)
+        return rows_affected
+
+    def on_sync_progress(self, table_name: str, rows_affected: int) -> None:
+        """Report the progress of a chunked statement, override it to track purges."""
+        logging.info(f"syncing table {table_name}, {rows_affected} rows affected")
 
     # this commented code needs to be putted in the child class
     # @consume(
@@ -102,11 +780,27 @@ class DbSyncConsumer:
     #         exchange=Exchange(f"{name}_exchange"),
     #         routing_key=f"{name}_routing_key",
     #     ),
+    #     accept=ACCEPTED_SERIALIZERS,
     # )
     # def consume_messages(self, body: dict[str, Any]) -> None:
     #     """Consume incoming requests to requester queue."""
     #
     #     self.sync_db_model(body)
+    #
+    # or to consume messages by batches
+    # @consume_batch(
+    #     Queue(
+    #         f"{name}_queue",
+    #         exchange=Exchange(f"{name}_exchange"),
+    #         routing_key=f"{name}_routing_key",
+    #     ),
+    #     batch_size=100,
+    #     batch_timeout=200,
+    # )
+    # def consume_messages(self, bodies: list[dict[str, Any]]) -> None:
+    #     """Consume incoming requests to requester queue by batches."""
+    #
+    #     self.sync_db_models(bodies)
 
 
 class DbSyncPublisher:
@@ -115,13 +809,125 @@ class DbSyncPublisher:
     After deleting some data if other data in another microservice needs to be synchronized.
     (UPDATE OR DELETE) we use this class to send a request in the queue by providing the required
     information's.
+
+    A publisher keeps a pool of connections and producers to rabbitmq_uri, exchanges are declared
+    once per connection and connection errors are retried with a new connection. Use
+    get_publisher to share one publisher per rabbitmq uri, serializer and confirm_publish in the
+    process. Messages are serialized with pickle by default, consumers accept both pickle and
+    myem-msgpack.
     """
 
+    publishers: dict[tuple[str, str, bool], "DbSyncPublisher"] = {}
+    publishers_lock = threading.Lock()
+
+    retry_policy = {"max_retries": 3, "interval_start": 0, "interval_step": 1, "interval_max": 5}
+
+    def __init__(
+        self,
+        rabbitmq_uri: str,
+        pool_limit: int = 10,
+        confirm_publish: bool = False,
+        serializer: str = "pickle",
+    ) -> None:
+        self.rabbitmq_uri = rabbitmq_uri
+        self.serializer = serializer
+        self.connection = Connection(
+            rabbitmq_uri, transport_options={"confirm_publish": confirm_publish}
+        )
+        self.producers = ProducerPool(self.connection.Pool(limit=pool_limit), limit=pool_limit)
+        self.exchanges: dict[str, Exchange] = {}
+
+    @classmethod
+    def get_publisher(
+        cls, rabbitmq_uri: str, serializer: str = "pickle", confirm_publish: bool = False
+    ) -> "DbSyncPublisher":
+        """Get the process wide publisher of a rabbitmq uri, serializer and confirm_publish."""
+        key = (rabbitmq_uri, serializer, confirm_publish)
+        if (publisher := cls.publishers.get(key)) is None:
+            with cls.publishers_lock:
+                if (publisher := cls.publishers.get(key)) is None:
+                    publisher = cls.publishers[key] = cls(
+                        rabbitmq_uri, confirm_publish=confirm_publish, serializer=serializer
+                    )
+        return publisher
+
+    def get_exchange(self, service_name: str) -> Exchange:
+        """Get the exchange of a service."""
+        if (exchange := self.exchanges.get(service_name)) is None:
+            exchange = self.exchanges[service_name] = Exchange(f"{service_name}_exchange")
+        return exchange
+
+    def publish(self, service_name: str, data: dict[str, list[RowToSyncType]]) -> None:
+        """Publish a sync request to a service."""
+        self.publish_batch([(service_name, data)])
+
+    def publish_batch(self, messages: list[tuple[str, dict[str, list[RowToSyncType]]]]) -> None:
+        """Publish several sync requests with a single producer.
+
+        Every message is stamped with a message id, kept when kombu retries the publish, used by
+        DbSyncConsumer to skip messages delivered twice.
+        When the publisher is created with confirm_publish, every message of the batch is
+        confirmed by the broker before returning.
+        """
+        with self.producers.acquire(block=True) as producer:
+            for service_name, data in messages:
+                logging.info(
+                    f"sending sync request to rabbitmq {self.rabbitmq_uri}, service {service_name}"
+                )
+                exchange = self.get_exchange(service_name)
+                message_id = str(uuid.uuid4())
+                producer.publish(
+                    body=data,
+                    exchange=exchange,
+                    declare=[exchange],
+                    routing_key=f"{service_name}_routing_key",
+                    serializer=self.serializer,
+                    message_id=message_id,
+                    headers={SYNC_MESSAGE_ID_HEADER: message_id},
+                    retry=True,
+                    retry_policy=self.retry_policy,
+                )
+
+    @classmethod
+    def buffered(
+        cls,
+        rabbitmq_uri: str,
+        max_rows: int = 1000,
+        max_age: float = 1.0,
+        serializer: str = "pickle",
+        confirm_publish: bool = False,
+    ) -> "DbSyncBuffer":
+        """Get a buffer coalescing sync requests before publishing them.
+
+        usage example:
+            with DbSyncPublisher.buffered(os.environ["RABBITMQ_URI"]) as sync_buffer:
+                for meter in meters:
+                    sync_buffer.sync_model(
+                        service_name="backbone_metrics_nrlink_service",
+                        data={"nrlink_power_metrics": [{
+                            "identifiers": [["meter_guid", "==", meter.guid]],
+                            "op": "DELETE",
+                        }]},
+                    )
+        """
+        return DbSyncBuffer(
+            cls.get_publisher(rabbitmq_uri, serializer, confirm_publish),
+            max_rows=max_rows,
+            max_age=max_age,
+        )
+
+    def close(self) -> None:
+        """Close the pooled producers and connections."""
+        self.producers.force_close_all()
+        self.producers.connections.force_close_all()
+
     @staticmethod
     def sync_model(
         rabbitmq_uri: str,
         service_name: str,
         data: dict[str, list[RowToSyncType]],
+        serializer: str = "pickle",
+        confirm_publish: bool = False,
     ) -> None:
         """Call the db sync service.
 
@@ -146,15 +952,109 @@ class DbSyncPublisher:
             },
         )
         """
-        logging.info(f"sending sync request to rabbitmq {rabbitmq_uri}, service {service_name}")
-        with Connection(rabbitmq_uri) as conn:
-            with conn.channel() as channel:
-                exchange = Exchange(f"{service_name}_exchange")
-                producer = Producer(channel)
-                producer.publish(
-                    body=data,
-                    exchange=exchange,
-                    declare=[exchange],
-                    routing_key=f"{service_name}_routing_key",
-                    serializer="pickle",
+        DbSyncPublisher.get_publisher(rabbitmq_uri, serializer, confirm_publish).publish(
+            service_name, data
+        )
+
+
+class DbSyncBuffer:
+    """Db sync Buffer.
+
+    Collects sync requests per service and table and publishes them as one message per service,
+    rows are merged with merge_rows_to_sync. The buffer is flushed when it holds max_rows rows,
+    when its oldest row is older than max_age seconds, on context exit and when the process exits.
+    A failed publish keeps the rows, its timer retries it backing off up to max_retry_delay seconds.
+    """
+
+    # buffers holding rows, referenced until they are published to flush them at exit
+    pending_buffers: set["DbSyncBuffer"] = set()
+    max_retry_delay: float = 60
+
+    def __init__(self, publisher: DbSyncPublisher, max_rows: int = 1000, max_age: float = 1.0):
+        self.publisher = publisher
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.pending: dict[str, dict[str, list[RowToSyncType]]] = {}
+        self.pending_rows = 0
+        self.first_row_at: float | None = None
+        self.timer: threading.Timer | None = None
+        self.retry_delay = 0.0
+        self.lock = threading.RLock()
+
+    def __enter__(self) -> "DbSyncBuffer":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.flush()
+
+    def sync_model(self, service_name: str, data: dict[str, list[RowToSyncType]]) -> None:
+        """Add a sync request to the buffer."""
+        with self.lock:
+            tables = self.pending.setdefault(service_name, {})
+            for table_name, rows_to_sync in data.items():
+                tables.setdefault(table_name, []).extend(rows_to_sync)
+                self.pending_rows += len(rows_to_sync)
+            if self.first_row_at is None:
+                self.first_row_at = time.monotonic()
+                self.pending_buffers.add(self)
+                self.start_timer(self.max_age)
+            if (
+                self.pending_rows >= self.max_rows
+                or time.monotonic() - self.first_row_at >= self.max_age
+            ):
+                self.flush()
+
+    def flush(self) -> None:
+        """Publish the pending sync requests, kept in the buffer if the publish fails."""
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            if not self.pending:
+                return
+            messages = [
+                (
+                    service_name,
+                    {
+                        table_name: merge_rows_to_sync(rows_to_sync)
+                        for table_name, rows_to_sync in tables.items()
+                    },
                 )
+                for service_name, tables in self.pending.items()
+            ]
+            try:
+                self.publisher.publish_batch(messages)
+            except Exception:
+                self.retry_delay = min(self.retry_delay * 2 or self.max_age, self.max_retry_delay)
+                self.start_timer(self.retry_delay)
+                raise
+            self.pending = {}
+            self.pending_rows = 0
+            self.first_row_at = None
+            self.retry_delay = 0.0
+            self.pending_buffers.discard(self)
+
+    def start_timer(self, delay: float) -> None:
+        """Flush the buffer in delay seconds."""
+        self.timer = threading.Timer(delay, self.flush_on_timer)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def flush_on_timer(self) -> None:
+        """Flush the buffer from its timer thread, logging errors which would be lost."""
+        try:
+            self.flush()
+        except Exception as e:
+            logging.error(
+                f"Could not flush sync buffer, rows are kept and retried in {self.retry_delay}s {e}"
+            )
+
+
+@atexit.register
+def flush_sync_buffers() -> None:
+    """Flush every sync buffer still holding rows when the process exits."""
+    for sync_buffer in list(DbSyncBuffer.pending_buffers):
+        try:
+            sync_buffer.flush()
+        except Exception as e:
+            logging.error(f"Could not flush sync buffer {e}")
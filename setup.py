@@ -25,9 +25,19 @@ setup(
         "fastapi_pagination>=0.9.1",
     ],
     extras_require={
+        # needed by services using the myem-msgpack serializer
+        "msgpack": ["msgpack>=1.0.0"],
+        # needed by apps using the orjson responses of fast_api_responses
+        "orjson": ["orjson>=3.6.0"],
+        # brotli compression of the responses, gzip is used without it
+        "brotli": ["brotli>=1.0.9"],
+        # sampling profiler of the requests profiled by the instrumentation, cProfile without it
+        "profiling": ["pyinstrument>=4.0.0"],
         "dev": [
             # this depdency should be present in the client, we only used it here for test.
             "nameko-sqlalchemy>=1.5.0",
+            "msgpack>=1.0.0",
+            "orjson>=3.6.0",
             "pytest>=6.2.5",
             "pytest-mock>=3.6.1",
             "coverage>=4.5.3",
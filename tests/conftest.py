@@ -0,0 +1,44 @@
+"""Tests fixtures."""
+# like the nameko test command, the nameko containers of the tests need eventlet to be patched
+# before anything else is imported
+import eventlet
+
+
+eventlet.monkey_patch()
+
+# pylint: disable=wrong-import-position
+import pytest  # noqa: E402
+from kombu.transport import memory
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+from tests.models import TestBase
+
+
+@pytest.fixture
+def db_session():
+    """Session of an in memory sqlite database with the tests tables."""
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    TestBase.metadata.create_all(engine)
+    session = Session(bind=engine)
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def memory_broker(monkeypatch):
+    """Make kombu's in memory transport usable by nameko services, use memory:// as AMQP_URI."""
+    # new messages are checked every second by default
+    monkeypatch.setattr(memory.Transport, "polling_interval", 0.01)
+    prepare_message = memory.Channel.prepare_message
+
+    # amqp brokers send the content type in the properties, read by nameko rpc replies
+    def prepare_message_with_content_type(self, body, priority=None, content_type=None, *args):
+        message = prepare_message(self, body, priority, content_type, *args)
+        message["properties"]["content_type"] = content_type
+        return message
+
+    monkeypatch.setattr(memory.Channel, "prepare_message", prepare_message_with_content_type)
@@ -0,0 +1,16 @@
+"""Models of the tests."""
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.orm import declarative_base
+
+
+TestBase = declarative_base()
+
+
+class Metric(TestBase):
+    """Metric model of the sync tests."""
+
+    __tablename__ = "metrics"
+
+    id = Column(Integer, primary_key=True)
+    meter_guid = Column(String, nullable=True)
+    value = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,119 @@
+"""Batch consumer tests."""
+import eventlet
+import pytest
+from kombu import Connection, Exchange, Queue
+from nameko.exceptions import ContainerBeingKilled
+from myem_lib.sync_handler import consume_batch, SyncMessageIds
+
+
+batch_exchange = Exchange("batch_exchange")
+batch_queue = Queue("batch_queue", exchange=batch_exchange, routing_key="batch_routing_key")
+
+
+class BatchService:
+    """Service consuming batches of 3 messages."""
+
+    name = "batch_service"
+    batches: list[list[str]] = []
+    message_ids: list[list[str | None]] = []
+    sync_message_ids = SyncMessageIds()
+
+    @consume_batch(batch_queue, batch_size=3, batch_timeout=100)
+    def handle_batch(self, bodies):
+        """Record the batch, fail if one of its messages is "fail"."""
+        self.batches.append(bodies)
+        self.message_ids.append(self.sync_message_ids)
+        if "fail" in bodies:
+            raise ValueError("failed batch")
+
+
+@pytest.fixture
+def container(container_factory, memory_broker):
+    """Started container of the batch service, on an in memory broker."""
+    BatchService.batches = []
+    BatchService.message_ids = []
+    container = container_factory(BatchService, {"AMQP_URI": "memory://"})
+    container.start()
+    # the in memory broker is shared by the tests
+    with Connection("memory://") as connection:
+        batch_queue(connection.channel()).purge()
+    yield container
+    container.stop()
+
+
+def publish(*bodies):
+    """Publish messages to the batch queue, with their body as message id."""
+    with Connection("memory://") as connection:
+        producer = connection.Producer()
+        for body in bodies:
+            producer.publish(
+                body,
+                exchange=batch_exchange,
+                routing_key="batch_routing_key",
+                declare=[batch_queue],
+                headers={"sync_message_id": body},
+                serializer="pickle",
+            )
+
+
+def wait_for_batches(count, timeout=2):
+    """Wait for the service to handle count batches, return them."""
+    with eventlet.Timeout(timeout):
+        while len(BatchService.batches) < count:
+            eventlet.sleep(0.01)
+    return BatchService.batches
+
+
+def wait_for_last_batches(count):
+    """Wait for the service to handle count batches and no other one, return them."""
+    wait_for_batches(count)
+    eventlet.sleep(0.3)
+    return BatchService.batches
+
+
+def get_queue_size():
+    """Get the number of messages waiting in the batch queue, unacknowledged ones included."""
+    with Connection("memory://") as connection:
+        return batch_queue(connection.channel()).queue_declare(passive=True).message_count
+
+
+def test_batch_is_handled_when_full(container):
+    """A batch is handled as soon as it has batch_size messages."""
+    publish("a", "b", "c", "d")
+    assert wait_for_batches(1, timeout=0.09) == [["a", "b", "c"]]
+    assert wait_for_last_batches(2) == [["a", "b", "c"], ["d"]]
+    assert BatchService.message_ids == [["a", "b", "c"], ["d"]]
+
+
+def test_batch_is_handled_after_timeout(container):
+    """A batch which is not full is handled batch_timeout after its first message."""
+    publish("a", "b")
+    eventlet.sleep(0.05)
+    assert not BatchService.batches
+    assert wait_for_last_batches(1) == [["a", "b"]]
+
+
+def test_failed_batch_is_retried_message_by_message(container):
+    """The messages of a failed batch are handled again one by one, then acknowledged."""
+    publish("a", "fail", "b")
+    batches = wait_for_last_batches(4)
+    assert batches[0] == ["a", "fail", "b"]
+    assert sorted(batches[1:]) == [["a"], ["b"], ["fail"]]
+    assert get_queue_size() == 0
+
+
+def test_batch_is_requeued_when_container_is_killed(container):
+    """The messages of a batch are requeued when the container refuses new workers."""
+    spawn_worker = container.spawn_worker
+    refused = []
+
+    def refuse_worker(*args, **kwargs):
+        if not refused:
+            refused.append(args)
+            raise ContainerBeingKilled()
+        return spawn_worker(*args, **kwargs)
+
+    container.spawn_worker = refuse_worker
+    publish("a", "b", "c")
+    assert wait_for_last_batches(1) == [["a", "b", "c"]]
+    assert len(refused) == 1
@@ -0,0 +1,60 @@
+"""Caches tests."""
+from myem_lib.caches import TtlLruCache
+from myem_lib.nameko_settings_mixins import RpcResultCache
+
+
+class Clock:
+    """Clock moved forward by the tests."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_key_is_dropped():
+    """The cache keeps the maxsize most recently used keys."""
+    cache = TtlLruCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_keys_expire_after_ttl_or_earlier_expiry():
+    """Keys expire ttl seconds after they are set, or at an earlier expiry."""
+    clock = Clock()
+    cache = TtlLruCache(10, ttl=60, clock=clock)
+    cache.set("ttl", 1)
+    cache.set("earlier", 2, expires_at=clock.now + 10)
+    cache.set("later", 3, expires_at=clock.now + 120)
+    clock.now += 10
+    assert cache.get("earlier", "expired") == "expired"
+    assert cache.get("ttl") == 1
+    clock.now += 50
+    assert "ttl" not in cache
+    assert "later" not in cache
+    assert len(cache) == 0
+
+
+def test_none_values_are_cached():
+    """Cached None values are told apart from missing keys by their entry."""
+    cache = TtlLruCache(10)
+    cache.set("none", None)
+    assert cache.get_entry("none") == (float("inf"), None)
+    assert cache.get_entry("missing") is None
+
+
+def test_rpc_result_cache_serves_none_results():
+    """None results of rpc methods are cached like others."""
+    calls = []
+    cache = RpcResultCache(ttl=60, maxsize=10)
+    for _ in range(2):
+        assert cache.get_or_call(lambda: calls.append(1), (1,), {}) is None
+    assert calls == [1]
+    assert cache.get_stats()["hits"] == 1
@@ -0,0 +1,120 @@
+"""FastApi settings mixin tests."""
+import json
+import random
+import timeit
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm, RSAAlgorithm
+from myem_lib.fast_api_settings_mixins import FastApiSettingsMixin
+
+
+KEYS = {
+    "RS256": (RSAAlgorithm, lambda: rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+    "ES256": (ECAlgorithm, lambda: ec.generate_private_key(ec.SECP256R1())),
+    "EdDSA": (OKPAlgorithm, ed25519.Ed25519PrivateKey.generate),
+}
+
+
+@pytest.mark.parametrize("algorithm", list(KEYS))
+def test_decode_token_of_key_type(algorithm):
+    """Tokens signed by RSA, EC and OKP keys are verified with their public JWK."""
+    algorithm_class, generate_private_key = KEYS[algorithm]
+    private_key = generate_private_key()
+    jwk = json.loads(algorithm_class.to_jwk(private_key.public_key()))
+
+    class Settings(FastApiSettingsMixin):
+        public_key_web_content = [{**jwk, "kid": "key_1"}]
+
+    token = jwt.encode({"id": 1}, private_key, algorithm=algorithm, headers={"kid": "key_1"})
+    assert Settings.decode_token(token, algorithms=(algorithm,)) == {"id": 1}
+
+
+def format_validation_errors_quadratic(validation_errors):
+    """Previous formatter of the validation exception handler, scanning the formatted errors."""
+    errors = []
+    for e in validation_errors:
+        new_dict = current = {}
+        existed = False
+        for item in errors:
+            if str(e["loc"][1]) == list(item.keys())[0]:
+                new_dict = current = item
+                existed = True
+                break
+        for i in range(1, len(e["loc"])):
+            if i == len(e["loc"]) - 1:
+                current[str(e["loc"][i])] = e["msg"]
+            elif current.get(str(e["loc"][i])):
+                current = current[str(e["loc"][i])]
+            else:
+                current[str(e["loc"][i])] = {}
+                current = current[str(e["loc"][i])]
+        if not existed:
+            errors.append(new_dict)
+    return errors
+
+
+def get_random_validation_errors(rng):
+    """Get a list of validation errors with random, often overlapping, locations."""
+    return [
+        {
+            "loc": (
+                "body",
+                rng.choice(["a", "b", "c", 0, 1]),
+                *(rng.choice(["x", "y", 2, 3]) for _ in range(rng.randint(1, 3))),
+            ),
+            "msg": str(rng.random()),
+        }
+        for _ in range(rng.randint(1, 30))
+    ]
+
+
+def test_format_validation_errors_is_identical_to_the_previous_formatter():
+    """The errors are formatted like the previous formatter on 2000 random error lists."""
+    rng = random.Random(1)
+    compared = 0
+    for _ in range(2000):
+        validation_errors = get_random_validation_errors(rng)
+        try:
+            expected = format_validation_errors_quadratic(validation_errors)
+        except Exception as e:
+            # the previous formatter fails when a location is both a message and a parent
+            with pytest.raises(type(e)):
+                FastApiSettingsMixin.format_validation_errors(validation_errors)
+            continue
+        assert FastApiSettingsMixin.format_validation_errors(validation_errors) == expected
+        compared += 1
+    assert compared > 500
+
+
+def test_format_validation_errors_limit():
+    """Only the first limit errors are reported."""
+    validation_errors = [{"loc": ("body", i, "value"), "msg": "field required"} for i in range(10)]
+    assert FastApiSettingsMixin.format_validation_errors(validation_errors, 3) == [
+        {"0": {"value": "field required"}},
+        {"1": {"value": "field required"}},
+        {"2": {"value": "field required"}},
+    ]
+
+
+def get_time(func, *args):
+    """Get the best time of func(*args) in milliseconds."""
+    return min(timeit.repeat(lambda: func(*args), number=1, repeat=3)) * 1000
+
+
+def test_format_validation_errors_benchmark():
+    """Formatting the errors of large payloads is linear, and faster than the previous formatter."""
+    format_validation_errors = FastApiSettingsMixin.format_validation_errors
+    times = {}
+    for count in (1000, 10000):
+        validation_errors = [
+            {"loc": ("body", i, "value"), "msg": "field required"} for i in range(count)
+        ]
+        times[count] = get_time(format_validation_errors, validation_errors)
+        print(f"{count} errors formatted in {times[count]:.2f} ms")
+    previous_time = get_time(format_validation_errors_quadratic, validation_errors[:1000])
+    print(f"1000 errors formatted in {previous_time:.2f} ms by the previous formatter")
+    # 10 times more errors take about 10 times longer, 100 times if it was quadratic
+    assert times[10000] < times[1000] * 30
+    assert previous_time > times[1000] * 10
@@ -0,0 +1,66 @@
+"""Pytest fixtures tests."""
+import asyncio
+
+from myem_lib.nameko_settings_mixins import (
+    AsyncRpcClient,
+    CustomClusterRpcClient,
+    NetworkClusterRpcClient,
+)
+
+
+def test_mocked_cluster_calls(mock_network_nameko_cluster):
+    """Mocked methods are served by attribute and item access."""
+    mock_network_nameko_cluster(
+        {"service_name": "meter_service", "function_name": "get_meter", "mocked_response": 1}
+    )
+    with NetworkClusterRpcClient() as rpc:
+        assert rpc.meter_service.get_meter(guid="a") == 1
+        assert rpc["meter_service"]["get_meter"](guid="a") == 1
+
+
+def test_mocked_cluster_fan_out(mock_network_nameko_cluster):
+    """Fan out gets the mocked responses, errors and function results of its calls."""
+    error = ValueError("unknown meter")
+    mock_network_nameko_cluster(
+        {"service_name": "meter_service", "function_name": "get_meter", "mocked_response": 1},
+        {"service_name": "meter_service", "function_name": "get_owner", "mocked_response": error},
+        {
+            "service_name": "contract_service",
+            "function_name": "get_contract",
+            "mocked_response": lambda guid: f"contract {guid}",
+        },
+    )
+    results = NetworkClusterRpcClient().fan_out(
+        [
+            ("meter_service", "get_meter", {"guid": "a"}),
+            ("meter_service", "get_owner", {"guid": "a"}),
+            ("contract_service", "get_contract", {"guid": "a"}),
+        ]
+    )
+    assert results == [1, error, "contract a"]
+
+
+def test_mocked_custom_cluster_fan_out(mock_custom_nameko_cluster):
+    """Fan out works with the clients taking positional arguments."""
+    mock_custom_nameko_cluster(
+        {"service_name": "bl_metrics", "function_name": "get_data", "mocked_response": [1, 2]}
+    )
+    client = CustomClusterRpcClient("memory://", None, 5)
+    assert client.fan_out([("bl_metrics", "get_data", {})]) == [[1, 2]]
+
+
+def test_mocked_cluster_async_rpc(mock_network_nameko_cluster):
+    """Async rpc clients of a mocked client class get the mocked responses."""
+    mock_network_nameko_cluster(
+        {"service_name": "meter_service", "function_name": "get_meter", "mocked_response": 1}
+    )
+    async_rpc = AsyncRpcClient(NetworkClusterRpcClient, pool_size=2)
+
+    async def get_meters():
+        return await asyncio.gather(
+            async_rpc.meter_service.get_meter(guid="a"),
+            async_rpc.with_timeout(5).meter_service.get_meter(guid="b"),
+        )
+
+    assert asyncio.run(get_meters()) == [1, 1]
+    async_rpc.close()
@@ -0,0 +1,107 @@
+"""Rpc client pool tests."""
+import eventlet
+import pytest
+from kombu import messaging
+from kombu.serialization import dumps
+from nameko.exceptions import RpcTimeout
+from nameko.rpc import rpc
+from myem_lib.instrumentation import metrics
+from myem_lib.nameko_settings_mixins import (
+    PooledClusterRpcClient,
+    PooledReplyListener,
+    RpcClientPool,
+    setup_serialization_config,
+)
+
+
+class EchoService:
+    """Service replying with its arguments."""
+
+    name = "echo_service"
+
+    @rpc
+    def echo(self, value, delay=0):
+        """Reply with value after delay seconds."""
+        eventlet.sleep(delay)
+        return value
+
+
+@pytest.fixture
+def pool(container_factory, memory_broker):
+    """Pool of clients of a started echo service, on an in memory broker."""
+    config = {"AMQP_URI": "memory://", "serializer": "pickle"}
+    container = container_factory(EchoService, config)
+    container.start()
+    setup_serialization_config("pickle")
+    pool = RpcClientPool(lambda: PooledClusterRpcClient(pooled=False, uri="memory://"), max_size=2)
+    yield pool
+    pool.close()
+
+
+def test_pooled_client_has_a_pooled_reply_listener():
+    """The pooled client builds its pooled reply listener, on the queue its calls reply to."""
+    cluster_rpc_client = PooledClusterRpcClient(pooled=False, uri="memory://")
+    reply_listener = cluster_rpc_client.reply_listener
+    assert type(reply_listener) is PooledReplyListener
+    cluster_rpc_client.client.register_for_reply("correlation_id")
+    assert "correlation_id" in reply_listener.pending
+
+
+def test_leased_client_is_reused(pool):
+    """Leased clients get their replies on their open connection and are reused."""
+    with pool.lease(timeout=5) as cluster_rpc_client:
+        assert cluster_rpc_client.client.echo_service.echo(1) == 1
+        connection = cluster_rpc_client.reply_listener.connection
+    with pool.lease(timeout=5) as reused_client:
+        assert reused_client.client.echo_service.echo(2) == 2
+    assert reused_client is cluster_rpc_client
+    assert reused_client.reply_listener.connection is connection
+
+
+def test_reply_timeout_discards_the_late_reply(pool):
+    """A call timing out raises RpcTimeout, its late reply is discarded by the next lease."""
+    with pool.lease(timeout=0.2) as cluster_rpc_client:
+        with pytest.raises(RpcTimeout):
+            cluster_rpc_client.client.echo_service.echo(1, delay=0.5)
+    assert not cluster_rpc_client.reply_listener.pending
+    eventlet.sleep(0.5)
+    with pool.lease(timeout=5) as cluster_rpc_client:
+        assert cluster_rpc_client.client.echo_service.echo(2) == 2
+        assert not cluster_rpc_client.reply_listener.pending
+
+
+def test_lost_reply_connection_is_reopened(pool):
+    """A reply listener which lost its connection reconnects while waiting for a reply."""
+    with pool.lease(timeout=5) as cluster_rpc_client:
+        cluster_rpc_client.reply_listener.disconnect()
+        assert cluster_rpc_client.client.echo_service.echo(1) == 1
+        assert cluster_rpc_client.reply_listener.is_healthy()
+
+
+def test_stopped_reply_listener_refuses_calls(pool):
+    """A stopped client can't be used anymore, like nameko's."""
+    with pool.lease(timeout=5) as cluster_rpc_client:
+        cluster_rpc_client.stop()
+        with pytest.raises(RuntimeError):
+            cluster_rpc_client.client.echo_service.echo(1)
+
+
+def test_instrumented_call_payload_is_serialized_once(pool, monkeypatch):
+    """The request size of an instrumented call is the size of the body kombu publishes."""
+    published_bodies = []
+    prepare = messaging.Producer._prepare
+
+    def record_prepare(producer, body, *args, **kwargs):
+        prepared = prepare(producer, body, *args, **kwargs)
+        published_bodies.append((body, prepared[0]))
+        return prepared
+
+    monkeypatch.setattr(messaging.Producer, "_prepare", record_prepare)
+    with PooledClusterRpcClient(uri="memory://", instrumented=True) as client:
+        assert client.echo_service.echo("x" * 100) == "x" * 100
+    body = dumps({"args": ("x" * 100,), "kwargs": {}}, "pickle")[2]
+    # kombu got the serialized body, and didn't serialize it again
+    assert (body, body) in published_bodies
+    histograms = metrics.histograms["rpc_client_request_size_bytes"]
+    histogram = histograms[(("service", "echo_service"), ("method", "echo"))]
+    assert histogram.sum == len(body) * histogram.count
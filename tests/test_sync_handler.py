@@ -0,0 +1,205 @@
+"""Sync handler tests."""
+import gc
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from kombu import Connection, Exchange, Queue
+from sqlalchemy import select
+from myem_lib.sync_handler import (
+    DbSyncBuffer,
+    DbSyncConsumer,
+    DbSyncPublisher,
+    flush_sync_buffers,
+    merge_rows_to_sync,
+    sync_messages_table,
+)
+from tests.models import Metric
+
+
+class MetricsConsumer(DbSyncConsumer):
+    """Consumer of the metrics table."""
+
+    name = "metrics_service"
+    models = [Metric]
+
+
+def make_consumer(db_session, **options):
+    """Make a consumer syncing in db_session, without deduplication."""
+    consumer = MetricsConsumer()
+    consumer.db = db_session
+    consumer.deduplication_store = None
+    # every test has its own database
+    consumer.sync_messages_table_created = False
+    for name, value in options.items():
+        setattr(consumer, name, value)
+    return consumer
+
+
+def add_metrics(db_session, count=25):
+    """Add count metrics spread over 3 meters, and one without meter."""
+    db_session.add_all(
+        Metric(id=index, meter_guid=f"meter_{index % 3}", value=index) for index in range(count)
+    )
+    db_session.add(Metric(id=count, meter_guid=None, value=count))
+    db_session.commit()
+
+
+ROWS_TO_SYNC = [
+    [{"identifiers": [["meter_guid", "==", "meter_1"]], "op": "DELETE"}],
+    [{"identifiers": [["meter_guid", "in_", ["meter_0", "meter_2"]]], "op": "DELETE"}],
+    [{"identifiers": [["meter_guid", "==", None]], "op": "DELETE"}],
+    [{"identifiers": [["id", ">=", 10], ["value", "<", 20]], "op": "DELETE"}],
+    [{"identifiers": [], "op": "DELETE"}],
+    [
+        {
+            "identifiers": [["meter_guid", "!=", "meter_0"]],
+            "op": "UPDATE",
+            "columns_to_sync": {"value": -1},
+        }
+    ],
+    [{"identifiers": [], "op": "UPDATE", "columns_to_sync": {"value": 0}}],
+]
+
+
+@pytest.mark.parametrize("rows_to_sync", ROWS_TO_SYNC)
+@pytest.mark.parametrize("sync_in_transaction", [False, True])
+def test_chunked_sync_affects_the_same_rows(db_session, rows_to_sync, sync_in_transaction):
+    """Chunked mode affects the same rows as the single statement mode."""
+    results = []
+    for chunk_size in (None, 4):
+        add_metrics(db_session)
+        consumer = make_consumer(
+            db_session, chunk_size=chunk_size, sync_in_transaction=sync_in_transaction
+        )
+        rows_affected = consumer.sync_db_model({"metrics": rows_to_sync})
+        rows = db_session.execute(select(Metric.id, Metric.value).order_by(Metric.id)).all()
+        results.append((rows_affected, rows))
+        db_session.query(Metric).delete()
+        db_session.commit()
+    assert results[0] == results[1]
+    assert results[0][0]["metrics"] > 0
+
+
+class FailingPublisher:
+    """Publisher failing its first failures publishes."""
+
+    def __init__(self, failures=1):
+        self.failures = failures
+        self.batches = []
+
+    def publish_batch(self, messages):
+        """Record the published messages, or fail."""
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("broker down")
+        self.batches.append(messages)
+
+
+DELETE_ROW = {"identifiers": [["meter_guid", "==", "meter_1"]], "op": "DELETE"}
+MERGED_DELETE_ROWS = merge_rows_to_sync([DELETE_ROW])
+
+
+def test_buffer_timer_retries_a_failed_flush():
+    """A failed timer flush keeps the rows and is retried by the timer."""
+    publisher = FailingPublisher(failures=2)
+    sync_buffer = DbSyncBuffer(publisher, max_age=0.05)
+    sync_buffer.sync_model("metrics_service", {"metrics": [DELETE_ROW]})
+    deadline = time.monotonic() + 2
+    while not publisher.batches and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert publisher.batches == [[("metrics_service", {"metrics": MERGED_DELETE_ROWS})]]
+    assert publisher.failures == 0
+    assert not sync_buffer.pending and sync_buffer.retry_delay == 0
+    assert sync_buffer not in DbSyncBuffer.pending_buffers
+
+
+def test_buffer_retry_delay_backs_off():
+    """The retry delay doubles on each failure up to max_retry_delay."""
+    sync_buffer = DbSyncBuffer(FailingPublisher(failures=10), max_age=10)
+    sync_buffer.max_retry_delay = 30
+    sync_buffer.sync_model("metrics_service", {"metrics": [DELETE_ROW]})
+    delays = []
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            sync_buffer.flush()
+        delays.append(sync_buffer.retry_delay)
+    sync_buffer.timer.cancel()
+    assert delays == [10, 20, 30]
+    assert sync_buffer.pending_rows == 1
+    DbSyncBuffer.pending_buffers.discard(sync_buffer)
+
+
+def test_unreferenced_buffer_is_flushed_at_exit():
+    """A buffer holding rows is flushed at exit even without other references."""
+    publisher = FailingPublisher(failures=0)
+    sync_buffer = DbSyncBuffer(publisher, max_age=60)
+    sync_buffer.sync_model("metrics_service", {"metrics": [DELETE_ROW]})
+    sync_buffer.timer.cancel()
+    del sync_buffer
+    gc.collect()
+    flush_sync_buffers()
+    assert publisher.batches == [[("metrics_service", {"metrics": MERGED_DELETE_ROWS})]]
+
+
+@pytest.mark.parametrize("sync_in_transaction", [False, True])
+def test_persisted_message_ids_skip_synced_messages(db_session, sync_in_transaction):
+    """Persisted ids skip messages synced before, in every sync mode."""
+    add_metrics(db_session)
+    consumer = make_consumer(
+        db_session, persist_message_ids=True, sync_in_transaction=sync_in_transaction
+    )
+    body = {"metrics": [DELETE_ROW]}
+    assert consumer.sync_db_model(body, message_id="message_1") == {"metrics": 8}
+    db_session.add(Metric(id=100, meter_guid="meter_1"))
+    db_session.commit()
+    assert consumer.sync_db_model(body, message_id="message_1") == {}
+    assert db_session.get(Metric, 100) is not None
+    assert db_session.execute(select(sync_messages_table.c.message_id)).scalars().all() == [
+        "message_1"
+    ]
+
+
+def test_expired_message_ids_are_purged(db_session):
+    """Ids older than sync_messages_ttl are deleted when ids are persisted."""
+    consumer = make_consumer(db_session, persist_message_ids=True)
+    consumer.sync_messages_purged_at = 0
+    consumer.create_sync_messages_table()
+    db_session.execute(
+        sync_messages_table.insert().values(
+            message_id="expired", created_at=datetime.now() - timedelta(hours=2)
+        )
+    )
+    consumer.sync_db_model({"metrics": [DELETE_ROW]}, message_id="message_1")
+    assert db_session.execute(select(sync_messages_table.c.message_id)).scalars().all() == [
+        "message_1"
+    ]
+
+
+def test_publishers_are_shared_per_serializer_and_confirm_publish():
+    """Shared publishers use the serializer and confirm_publish they are requested with."""
+    publisher = DbSyncPublisher.get_publisher("memory://", serializer="json", confirm_publish=True)
+    assert publisher.serializer == "json"
+    assert publisher.connection.transport_options == {"confirm_publish": True}
+    assert DbSyncPublisher.get_publisher("memory://", "json", True) is publisher
+    assert DbSyncPublisher.get_publisher("memory://") is not publisher
+    assert DbSyncPublisher.get_publisher("memory://").serializer == "pickle"
+    assert DbSyncPublisher.buffered("memory://", serializer="json").publisher.serializer == "json"
+
+
+def test_sync_model_publishes_with_the_serializer():
+    """Static sync requests are serialized with the requested serializer."""
+    queue = Queue(
+        "metrics_service_json_queue",
+        Exchange("metrics_service_exchange"),
+        routing_key="metrics_service_routing_key",
+    )
+    with Connection("memory://") as connection:
+        queue(connection.default_channel).declare()
+        DbSyncPublisher.sync_model(
+            "memory://", "metrics_service", {"metrics": [DELETE_ROW]}, serializer="json"
+        )
+        message = queue(connection.default_channel).get(no_ack=True)
+        queue(connection.default_channel).delete()
+    assert message.content_type == "application/json"
+    assert message.decode() == {"metrics": [DELETE_ROW]}